@@ -1,27 +1,329 @@
 # "Short range ballistic trajectories" is a library that let's you compute different properties of the ballistic
 # trajectory of a free rigid body in motion.
+# SciPy, matplotlib, Numba and the process pool are only imported when first needed, so that importing this module
+# stays cheap for code that only uses the closed-form methods. Check with: python -X importtime -c "import trajectory"
+# The methods of Tr, TrBatch and FiringTable only read the body and the module settings (g, p, executor), so bodies
+# can be queried from several threads at once. Change the settings before starting threads, or give each body an
+# Environment instead of changing g and p. A SolutionCache may be shared between threads, plots are only drawn on the
+# axes passed to add_plot (or pyplot's current axes), and the instrument() hooks see the work of every thread.
 import math
-import matplotlib.pyplot as plt
-from scipy.integrate import solve_ivp as solve
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import repeat
+import numpy as np
 
 g = 9.8
 p = 1.204  # kg/m³ density of air at NTP
 
+
+# functions called with a record (a dictionary) of every integration, root search and cache lookup, see instrument()
+# add_hook and remove_hook replace the list instead of changing it, so that it can be iterated without a lock
+_listeners = []
+_hooks_lock = threading.Lock()
+
+
+def _emit(record):
+    for listener in _listeners:
+        listener(record)
+
+
+def solve(fun, t_span, y0, **options):
+    """Call scipy.integrate.solve_ivp, which is imported on first use."""
+    from scipy.integrate import solve_ivp
+    cancellation = getattr(_local, "cancellation", None)
+    if cancellation is not None:
+        fun = _cancellable(fun, cancellation)
+    if not _listeners:
+        return solve_ivp(fun, t_span, y0, **options)
+    method = options.get("method", "RK45")
+    counts = {"steps": 0, "rejected": None}
+    if isinstance(method, str):
+        options["method"] = _counting_solver(method, counts)
+    start = time.perf_counter()
+    sol = solve_ivp(fun, t_span, y0, **options)
+    _emit({"kind": "solve", "method": method, "time": time.perf_counter() - start, "nfev": int(sol.nfev),
+           "njev": int(sol.njev), "steps": counts["steps"], "rejected": counts["rejected"], "status": sol.status})
+    return sol
+
+
+def _counting_solver(method, counts):
+    """Return a subclass of the solve_ivp method that counts accepted steps in counts["steps"] and, for Runge-Kutta
+    methods, rejected steps in counts["rejected"]."""
+    import scipy.integrate
+    base = getattr(scipy.integrate, method)
+
+    class CountingSolver(base):
+        def _step_impl(self):
+            nfev = self.nfev
+            success, message = base._step_impl(self)
+            counts["steps"] += success
+            if hasattr(self, "n_stages"):  # every attempted Runge-Kutta step evaluates the right-hand side n_stages times
+                counts["rejected"] = (counts["rejected"] or 0) + (self.nfev - nfev)//self.n_stages - success
+            return success, message
+
+    return CountingSolver
+
+
+class Stats:
+    """Counters of the work done by this module while instrument() is active: integrations (calls), their wall time
+    in seconds (time), right-hand side and Jacobian evaluations (nfev, njev), accepted and rejected steps (steps,
+    rejected), landing points evaluated by root searches in Tr.i_vel (root_iterations) and SolutionCache lookups
+    (cache_hits, cache_misses). Steps of the TrBatch integrator are counted per body."""
+
+    _lock = threading.Lock()  # records may come from several threads
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.nfev = 0
+        self.njev = 0
+        self.steps = 0
+        self.rejected = 0
+        self.root_iterations = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, record):
+        with Stats._lock:
+            Stats.__count(self, record)
+
+    def __count(self, record):
+        kind = record["kind"]
+        if kind == "solve" or kind == "batch":
+            self.calls += 1
+            self.time += record["time"]
+            self.nfev += record["nfev"]
+            self.njev += record.get("njev", 0)
+            self.steps += record["steps"]
+            self.rejected += record["rejected"] or 0
+        elif kind == "i_vel":
+            self.root_iterations += record["iterations"]
+        elif kind == "cache":
+            if record["hit"]:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def __repr__(self):
+        return "Stats(" + ", ".join(k + "=" + repr(v) for k, v in vars(self).items()) + ")"
+
+
+@contextmanager
+def instrument(hook=None):
+    """Return a context manager that counts the work done inside it in a Stats object, e.g.
+    with instrument() as stats: body.landing_point(True). Set hook to a function to also receive the record of
+    every integration, root search and cache lookup as a dictionary."""
+    stats = Stats()
+    add_hook(stats)
+    if hook is not None:
+        add_hook(hook)
+    try:
+        yield stats
+    finally:
+        remove_hook(stats)
+        if hook is not None:
+            remove_hook(hook)
+
+
+def add_hook(hook):
+    """Call hook with the record of every integration, root search and cache lookup as a dictionary with the key
+    "kind" ("solve", "batch", "i_vel" or "cache"), until remove_hook is called. Return None."""
+    global _listeners
+    with _hooks_lock:
+        _listeners = _listeners + [hook]
+    return None
+
+
+def remove_hook(hook):
+    """Stop calling a hook added with add_hook. Return None."""
+    global _listeners
+    with _hooks_lock:
+        listeners = list(_listeners)
+        listeners.remove(hook)
+        _listeners = listeners
+    return None
+
+
+# executor of the asynchronous Tr methods (alanding_point, ...), None for the default executor of the event loop
+executor = None
+
+# requests in flight for every event loop, by key of the body, method and arguments
+_requests = weakref.WeakKeyDictionary()
+
+# the cancellation flag of the request run by the current executor thread, checked by solve() to stop cancelled
+# integrations
+_local = threading.local()
+
+
+class _Cancellation:
+    """Flag set once every caller of a request has left. This is the part of a request that is sent to the executor,
+    a process pool gets a copy that is never set."""
+
+    def __init__(self):
+        self.cancelled = False
+
+
+class _Request:
+    def __init__(self):
+        self.future = None
+        self.waiters = 0
+        self.cancellation = _Cancellation()
+
+
+def _cancellable(fun, cancellation):
+    """Return the right-hand side fun, which raises RuntimeError once cancellation is set."""
+    def f(t, r, *args):
+        if cancellation.cancelled:
+            raise RuntimeError("The integration was cancelled.")
+        return fun(t, r, *args)
+    return f
+
+
+def _call(cancellation, f, args):
+    _local.cancellation = cancellation
+    try:
+        return f(*args)
+    finally:
+        _local.cancellation = None
+
+
+def _hashable(a):
+    if isinstance(a, (list, tuple, np.ndarray)):
+        return tuple(_hashable(b) for b in a)
+    return a
+
+
+async def _run(key, f, args, timeout):
+    """Run f(*args) in executor and return the result. Requests with the same key share one call while it is in
+    flight, which is cancelled once every caller has been cancelled or has timed out: dropped if it has not started
+    yet, else stopped at the next right-hand side evaluation if it runs in a thread."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    requests = _requests.setdefault(loop, {})
+    request = requests.get(key)
+    if request is None:
+        request = _Request()
+        request.future = loop.run_in_executor(executor, _call, request.cancellation, f, args)
+        requests[key] = request
+
+        def done(future):
+            if requests.get(key) is request:
+                del requests[key]
+            if not future.cancelled():
+                future.exception()  # retrieved, also when every caller has left
+        request.future.add_done_callback(done)
+    request.waiters += 1
+    try:
+        return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+    finally:
+        request.waiters -= 1
+        if request.waiters == 0 and not request.future.done():
+            request.cancellation.cancelled = True
+            request.future.cancel()
+            del requests[key]
+
+
+class Environment:
+    """Gravity g in m/s², air density in kg/m³ and a constant wind [wx, wy] in m/s that bodies move through. density is
+    a scalar, or an array of densities at the heights y = 0, dy, 2*dy, ... that is interpolated linearly and held
+    constant below and above the table, see standard_atmosphere(). The wind may have a third component wz, a crosswind
+    that only bodies of Tr3D feel."""
+
+    __slots__ = ("g", "density", "dy", "wind")
+
+    def __init__(self, g=9.8, density=1.204, wind=(0, 0), dy=None):
+        if dy is None and np.ndim(density) > 0:
+            raise ValueError("The height step dy of the density table has to be provided.")
+        if dy is not None and (np.ndim(density) != 1 or len(density) < 2):
+            raise ValueError("The density table has to hold at least 2 densities when dy is provided.")
+        self.g = g
+        self.density = density if dy is None else np.asarray(density, dtype=float)
+        self.dy = dy
+        self.wind = tuple(wind)
+
+    def density_at(self, y):
+        """Return the air density at height y, a scalar or an array."""
+        if self.dy is None:
+            return self.density
+        d = self.density
+        s = np.clip(np.asarray(y, dtype=float)/self.dy, 0, len(d) - 1)
+        i = np.minimum(s.astype(int), len(d) - 2)
+        return d[i] + (d[i + 1] - d[i])*(s - i)
+
+
+# base altitude (m) and temperature lapse rate (K/m) of the layers of the International Standard Atmosphere
+_isa_layers = [(0, -0.0065), (11000, 0), (20000, 0.001), (32000, 0.0028), (47000, 0), (51000, -0.0028),
+               (71000, -0.002), (84852, 0)]
+
+
+def _isa_layer(dh, T, P, lapse):
+    """Return temperature and pressure at dh above the base of an atmospheric layer with temperature T, pressure P and
+    temperature lapse rate at its base."""
+    R = 287.05287  # J/(kg K) specific gas constant of dry air
+    g0 = 9.80665
+    if lapse == 0:
+        return T + 0*dh, P*np.exp(-g0*dh/(R*T))
+    return T + lapse*dh, P*(T/(T + lapse*dh))**(g0/(R*lapse))
+
+
+def _isa_density(h):
+    """Return the density of the International Standard Atmosphere at the geopotential altitudes h (an array)."""
+    T = 288.15
+    P = 101325.0
+    rho = np.empty(len(h))
+    for i, (base, lapse) in enumerate(_isa_layers):
+        top = _isa_layers[i + 1][0] if i + 1 < len(_isa_layers) else np.inf
+        m = (h < top) if i == 0 else (h >= base) & (h < top)  # the lowest layer also extends below sea level
+        T_h, P_h = _isa_layer(h[m] - base, T, P, lapse)
+        rho[m] = P_h/(287.05287*T_h)
+        if top < np.inf:
+            T, P = _isa_layer(top - base, T, P, lapse)
+    return rho
+
+
+def standard_atmosphere(altitude=0, g=9.8, wind=(0, 0), dy=100, top=84000):
+    """Return an Environment with the air density of the International Standard Atmosphere (1976), tabulated every dy
+    meters from the ground at altitude meters above sea level up to an altitude top."""
+    return Environment(g, _isa_density(np.arange(altitude, top + dy, dy, dtype=float)), wind, dy)
+
+
+def _pyplot():
+    import matplotlib.pyplot as plt
+    return plt
+
+
 class Tr:
     """Compute different properties of the ballistic trajectory of a free body in motion. SI-units are assumed."""
 
+    __slots__ = ("init_pos", "init_vel", "area", "mass", "c", "method", "rtol", "atol", "cache", "analytic", "env")
+
     def __init__(self):
-        """Initialize a body as an object with properties at time t=0."""
+        """Initialize a body as an object with properties at time t=0. Trajectories with air resistance are
+        integrated with scipy's solve_ivp using method and the tolerances rtol and atol. Set cache to a SolutionCache
+        to reuse these trajectories between calls. Bodies moving straight up or down, and flat trajectories whose
+        slope |vy/vx| stays below sqrt(rtol*(2 + rtol)), use a closed-form solution instead, which is exact for
+        vertical motion and off by less than rtol times the distance travelled for flat fire. Set analytic=False to
+        always integrate. Set env to an Environment to change gravity, air density and wind for this body, by default
+        the module's g and p apply without wind."""
         self.init_pos = [0, 0]
         self.init_vel = [0, 0]
         self.area = None
         self.mass = None
         self.c = None
+        self.method = "RK45"
+        self.rtol = 1e-3
+        self.atol = 1e-6
+        self.cache = None
+        self.analytic = True
+        self.env = None
 
     def __drag(self):
-        v = self.init_vel
         try:
-            f = 0.5*p*self.c*self.area
+            f = 0.5*self.c*self.area
         except:
             f = 0
         if f == 0:
@@ -29,59 +331,136 @@ class Tr:
                                "perform this operation")
         return f
 
-    def __ode_solver(self, t):
-        c = Tr.__drag(self)
-        x0 = self.init_pos[0]
-        y0 = self.init_pos[1]
-        v0x = self.init_vel[0]
-        v0y = self.init_vel[1]
-        r = [v0x, x0, v0y, y0]
-        m = self.mass
-        f = lambda t, r: [-c/m*r[0]*(r[0]**2+r[2]**2)**0.5, r[0],-c/m*r[2]*(r[0]**2+r[2]**2)**0.5-g, r[2]]
-        return solve(f, [0, t], r)
+    def __gravity(self):
+        return g if self.env is None else self.env.g
+
+    def __ode(self):
+        """Return right-hand side and Jacobian of the drag ODE of this body, their extra arguments and the drag factor
+        k = 0.5*density*c*area/mass, which is None if the density varies or there is wind."""
+        env = self.env
+        k = Tr.__drag(self)/self.mass
+        if env is None:
+            return _drag_kernel() + ((k*p, g), k*p)
+        if env.dy is None and not any(env.wind[:2]):
+            return _drag_kernel() + ((k*env.density, env.g), k*env.density)
+        rhs, jac = _drag_env_kernel()
+        if env.dy is None:
+            density, dy = [env.density, env.density], 1.0
+        else:
+            density, dy = env.density, env.dy
+        if kernel_backend != "numba":
+            density = list(density)
+        return rhs, jac, (k, env.g, env.wind[0], env.wind[1], density, dy), None
+
+    def __solve(self, v0, t_max, events=None, t_eval=None, dense_output=False):
+        rhs, jac, args, k = Tr.__ode(self)
+        r = [v0[0], self.init_pos[0], v0[1], self.init_pos[1]]
+        return solve(rhs, [0, t_max], r, events=events, t_eval=t_eval, dense_output=dense_output, args=args,
+                     **Tr.__solver_options(self, jac))
+
+    def __solver_options(self, jac):
+        options = {"method": self.method, "rtol": self.rtol, "atol": self.atol}
+        if self.method in _implicit_methods:
+            options["jac"] = jac
+        return options
+
+    def __ode_solver(self, t, t_eval=None):
+        return Tr.__solve(self, self.init_vel, t, t_eval=t_eval)
 
     def __ode_solver_impact(self, v0, t_max):
-        c = Tr.__drag(self)
-        x0 = self.init_pos[0]
-        y0 = self.init_pos[1]
-        v0x = v0[0]
-        v0y = v0[1]
-        r = [v0x, x0, v0y, y0]
-        m = self.mass
-        f = lambda t, r: [-c/m*r[0]*(r[0]**2+r[2]**2)**0.5, r[0],-c/m*r[2]*(r[0]**2+r[2]**2)**0.5-g, r[2]]
-        hit = lambda t, r: r[3]
+        hit = lambda t, r, *args: r[3]
         hit.terminal = True
         hit.direction = -1
-        return solve(f, [0, t_max], r, events=hit)
+        return Tr.__solve(self, v0, t_max, hit)
 
     def __ode_solver_reach_x(self, x, v0, t_max):
-        c = Tr.__drag(self)
-        x0 = self.init_pos[0]
-        y0 = self.init_pos[1]
-        v0x = v0[0]
-        v0y = v0[1]
-        r = [v0x, x0, v0y, y0]
-        m = self.mass
-        f = lambda t, r: [-c/m*r[0]*(r[0]**2+r[2]**2)**0.5, r[0],-c/m*r[2]*(r[0]**2+r[2]**2)**0.5-g, r[2]]
-        hit = lambda t, r: x - r[1]  # 0 at goal
+        hit = lambda t, r, *args: x - r[1]  # 0 at goal
         hit.terminal = True
-        return solve(f, [0, t_max], r, events=hit)
+        return Tr.__solve(self, v0, t_max, hit)
 
     def __ode_solver_max_y(self, v0, t_max):
-        c = Tr.__drag(self)
-        x0 = self.init_pos[0]
-        y0 = self.init_pos[1]
-        v0x = v0[0]
-        v0y = v0[1]
-        r = [v0x, x0, v0y, y0]
-        m = self.mass
-        f = lambda t, r: [-c/m*r[0]*(r[0]**2+r[2]**2)**0.5, r[0],-c/m*r[2]*(r[0]**2+r[2]**2)**0.5-g, r[2]]
-        hit = lambda t, r: r[2]  # 0 at goal
+        hit = lambda t, r, *args: r[2]  # 0 at goal
         hit.terminal = True
-        return solve(f, [0, t_max], r, events=hit)
+        return Tr.__solve(self, v0, t_max, hit)
+
+    def __key(self, v0):
+        env = self.env
+        if env is None:
+            env = (g, p)
+        else:
+            env = (env.g, env.density if env.dy is None else env.density.tobytes(), env.dy, env.wind)
+        return (tuple(self.init_pos), tuple(v0), self.mass, self.area, self.c, env, self.method, self.rtol, self.atol)
+
+    def __flight(self, v0=None):
+        if not v0:
+            v0 = self.init_vel
+        key = Tr.__key(self, v0)
+        flight = self.cache.get(key)
+        if flight is None:
+            rhs, jac, args, k = Tr.__ode(self)
+            flight = _Flight([v0[0], self.init_pos[0], v0[1], self.init_pos[1]], rhs, args,
+                             Tr.__solver_options(self, jac))
+            self.cache.put(key, flight)
+        return flight
+
+    def __cached_state(self, t):
+        flight = Tr.__flight(self)
+        flight.extend(t)
+        return flight(t)
+
+    def __analytic_k(self):
+        """Return the drag factor k if closed-form solutions are enabled and apply (constant, nonzero density and no
+        wind), else None."""
+        return Tr.__ode(self)[3] or None if self.analytic else None
+
+    def __is_flat(self, v):
+        return abs(v[1]) <= math.sqrt(self.rtol*(2 + self.rtol))*abs(v[0])
+
+    def __analytic_state(self, v0, t):
+        """Return the state [vx, x, vy, y] at time t from a closed-form solution, or None if none applies."""
+        k = Tr.__analytic_k(self)
+        if k is None:
+            return None
+        g = Tr.__gravity(self)
+        x0, y0 = self.init_pos
+        if v0[0] == 0:
+            return [0, x0] + _vertical_state(v0[1], y0, k, g, t)
+        r = _flat_state(v0[0], v0[1], x0, y0, k, g, t)
+        if Tr.__is_flat(self, v0) and Tr.__is_flat(self, r[0::2]):
+            return r
+        return None
+
+    def __analytic_impact(self, v0, t_no_air):
+        """Return [x, 0, t] at impact from a closed-form solution, None if the body never lands or False if no
+        closed-form solution applies."""
+        k = Tr.__analytic_k(self)
+        if k is None:
+            return False
+        g = Tr.__gravity(self)
+        x0, y0 = self.init_pos
+        if v0[0] == 0:
+            t = _vertical_impact(v0[1], y0, k, g)
+            return None if t is None else [x0, 0, t]
+        if not Tr.__is_flat(self, v0):
+            return False
+        impact = _flat_impact(v0[0], v0[1], x0, y0, k, g, t_no_air)
+        if impact is None or not Tr.__is_flat(self, impact[1][0::2]):
+            return False
+        return [impact[1][1], 0, impact[0]]
+
+    def __state(self, t):
+        """Return the state [vx, x, vy, y] at time t with air resistance."""
+        r = Tr.__analytic_state(self, self.init_vel, t)
+        if r is not None:
+            return r
+        if self.cache is not None:
+            return Tr.__cached_state(self, t)
+        sol = Tr.__ode_solver(self, t)
+        return sol.y[:, -1]
 
     def pos(self, t, air=False):
         """Return position of this body at time t as a list/vector [x, y]. Set air=True to apply air resistance."""
+        g = Tr.__gravity(self)
         x0 = self.init_pos[0]
         y0 = self.init_pos[1]
         v0x = self.init_vel[0]
@@ -91,25 +470,22 @@ class Tr:
             x = v0x * t + x0
             p = [x, y]
         else:
-            sol = Tr.__ode_solver(self, t)
-            last = len(sol.t)-1
-            x = sol.y[1][last]
-            y = sol.y[3][last]
-            p = [x, y]
+            r = Tr.__state(self, t)
+            p = [r[1], r[3]]
         return p
 
     def v(self, t, air=False):
         """Return velocity of this body at time t as a list/vector [vx, vy]. Set air=True to apply air resistance."""
+        g = Tr.__gravity(self)
         if not air:
             v0x = self.init_vel[0]
             v0y = self.init_vel[1]
             vy = -g * t + v0y
             vx = v0x
         else:
-            sol = Tr.__ode_solver(self, t)
-            last = len(sol.t) - 1
-            vx = sol.y[0][last]
-            vy = sol.y[2][last]
+            r = Tr.__state(self, t)
+            vx = r[0]
+            vy = r[2]
         return [vx, vy]
 
     def speed(self, t, air=False):
@@ -117,42 +493,36 @@ class Tr:
         v = Tr.v(self, t, air)
         return (v[1]**2 + v[0]**2)**0.5
 
-    def i_vel(self, x, a, air=False, tol=0.001):
+    def i_vel(self, x, a, air=False, tol=0.001, method="secant", full_output=False):
         """Return necessary initial speed at angle a in degrees for this body to land at a distance x as a scalar.
         Set air=True to apply air resistance. Set a lower tolerance tol to get a more precise answer.
-        RuntimeError is raised if no solution is found."""
+        With air resistance the speed is found by root finding, choose method="secant" (bracketed secant),
+        "brent" or "bisect". Set full_output=True to get a list [v, n] where n is the number of landing points that
+        were evaluated. RuntimeError is raised if no solution is found."""
+        g = Tr.__gravity(self)
         a = a*math.pi/180
         x0 = self.init_pos[0]
         y0 = self.init_pos[1]
         v0x = abs(x - x0) * (1 / math.tan(a)) * (g * math.tan(a) / (2 * x - 2 * x0 + 2 * y0 * (1 / math.tan(a))))**0.5
         v0y = abs(x - x0) / (2 * (1 / math.tan(a)) * (x - x0 + y0 * (1 / math.tan(a))) / g) ** 0.5
-        q1 = x0*math.tan(a)
-        q2 = y0 + x*math.tan(a)
         v0 = [v0x, v0y]  # solution for no air resistance
+        errors = {}  # landing point error for each scale factor of v0 that has been tried
         if air:
-            tol = abs(tol*x)
-            error_c = 2*tol
-            a = -10
-            b = 10
-            c = 0
-            i = 0
-            while abs(error_c) > tol:
-                c = (a+b)/2
-                xc_result = Tr.landing_point(self, True, [c*v0x, c*v0y])[0]
-                error_c = x - xc_result
-                if error_c == 0:
-                    break
-                xa_result = Tr.landing_point(self, True, [a*v0x, a*v0y])[0]
-                error_a = x - xa_result
-                if error_a*error_c < 0:
-                    b = c
-                else:
-                    a = c
-                i += 1
+            def error(s):
+                if s not in errors:
+                    errors[s] = x - Tr.landing_point(self, True, [s*v0x, s*v0y])[0]
+                return errors[s]
+            start = time.perf_counter()
+            c = _find_root(error, -10, 10, abs(tol*x), tol, method)
+            if _listeners:
+                _emit({"kind": "i_vel", "method": method, "time": time.perf_counter() - start,
+                       "iterations": len(errors)})
             v0 = [c*v0x, c*v0y]
         v = (v0[0]**2 + v0[1]**2)**0.5
         if type(v) is complex:  # body never lands
             raise RuntimeError("No real solution was found.")
+        if full_output:
+            return [v, len(errors)]
         return v
 
     def set_vel_trig(self, speed, angle):
@@ -167,6 +537,7 @@ class Tr:
     def max_alt(self, air=False):
         """Return position and time of this body at it's highest altitude as a list [x, y, t].
         Set air=True to apply air resistance."""
+        g = Tr.__gravity(self)
         x0 = self.init_pos[0]
         y0 = self.init_pos[1]
         v0x = self.init_vel[0]
@@ -180,6 +551,18 @@ class Tr:
             if not air:
                 p = Tr.pos(self, tmax)
                 t = tmax
+            elif (v0x == 0 or Tr.__is_flat(self, self.init_vel)) and Tr.__analytic_k(self) is not None:
+                k = Tr.__analytic_k(self)
+                t = _vertical_apex_time(v0y, k, g) if v0x == 0 else _flat_apex_time(v0x, v0y, k, g)
+                p = Tr.pos(self, t, True)
+            elif self.cache is not None:
+                flight = Tr.__flight(self)
+                if flight.apex is None:
+                    flight.extend(tmax * 10, "apex")
+                if flight.apex is None:  # no solution was found
+                    return None
+                t, r = flight.apex
+                p = [r[1], r[3]]
             else:
                 sol = Tr.__ode_solver_max_y(self, [v0x, v0y], tmax * 10)
                 if len(sol.t_events[0]) == 0:  # no solution was found
@@ -189,13 +572,13 @@ class Tr:
                 x = sol.y[1][last]
                 y = sol.y[3][last]
                 p = [x, y]
-        p.append(t)
-        return p
+        return [p[0], p[1], t]
 
     def landing_point(self, air=False, v0=None):
         """Return landing point and moment of impact for this body as a list [x, y, t].
         Set air=True to apply air resistance. Override initial velocity of this body by providing a vector v0=[vx, vy].
         RuntimeError is raised if no solution is found."""
+        g = Tr.__gravity(self)
         x0 = self.init_pos[0]
         y0 = self.init_pos[1]
         if not v0:
@@ -212,6 +595,17 @@ class Tr:
         if not air:
             x = Tr.pos(self, t_imp_no_air)[0]
             return [x, 0, t_imp_no_air]
+        impact = Tr.__analytic_impact(self, [v0x, v0y], t_imp_no_air)
+        if impact is not False:
+            return impact
+        elif self.cache is not None:
+            flight = Tr.__flight(self, v0)
+            if flight.impact is None:
+                flight.extend(t_imp_no_air*10, "impact")
+            if flight.impact is None:  # no solution was found
+                return None
+            t, r = flight.impact
+            return [r[1], 0, t]
         else:
             sol = Tr.__ode_solver_impact(self, [v0x, v0y], t_imp_no_air*10)
             if len(sol.t_events[0]) == 0:  # no solution was found
@@ -221,6 +615,49 @@ class Tr:
             t = sol.t[last]
             return [x, 0, t]
 
+    def landing_gradient(self, air=False):
+        """Return landing point and moment of impact of this body with their derivatives with respect to initial speed,
+        initial angle in degrees, mass and drag coefficient as a list
+        [[x, y, t], [dx/dspeed, dx/dangle, dx/dmass, dx/dc], [dt/dspeed, dt/dangle, dt/dmass, dt/dc]]. Set air=True to
+        apply air resistance, the derivatives are then integrated together with the trajectory (forward sensitivities)
+        instead of integrating it again for every parameter. After small changes of the parameters the landing point is
+        close to x + dx/dspeed*dspeed + dx/dangle*dangle + ... . Return None if no solution is found, RuntimeError is
+        raised if the body never lands."""
+        g = Tr.__gravity(self)
+        x0 = self.init_pos[0]
+        y0 = self.init_pos[1]
+        v0x = self.init_vel[0]
+        v0y = self.init_vel[1]
+        speed = math.hypot(v0x, v0y)
+        a = math.atan2(v0y, v0x)
+        d = math.pi/180
+        dv0x = [math.cos(a), -speed*math.sin(a)*d, 0, 0]  # derivatives of v0x with respect to speed, angle, mass, c
+        dv0y = [math.sin(a), speed*math.cos(a)*d, 0, 0]
+        p = Tr.landing_point(self)
+        if p[2] == 0:
+            return [p, [0]*4, [0]*4]
+        if not air:
+            dt_dv0y = (1 + v0y/(v0y**2 + 2*y0*g)**0.5)/g
+            dt = [dt_dv0y*q for q in dv0y]
+            return [p, [q*p[2] + v0x*r for q, r in zip(dv0x, dt)], dt]
+        rhs, jac, args, k = Tr.__ode(self)
+        z0 = np.zeros(20)
+        z0[:4] = [v0x, x0, v0y, y0]
+        z0[4:8] = dv0x
+        z0[12:16] = dv0y
+        hit = lambda t, z, *args: z[3]
+        hit.terminal = True
+        hit.direction = -1
+        sol = solve(_sensitivity_rhs, [0, p[2]*10], z0, events=hit, args=(rhs, jac, args, g, self.mass, self.c),
+                    method=self.method, rtol=self.rtol, atol=self.atol)
+        if len(sol.t_events[0]) == 0:  # no solution was found
+            return None
+        z = sol.y_events[0][0]
+        s = z[4:].reshape(4, 4)
+        dt = -s[3]/z[2]  # y stays 0 at impact
+        dx = s[1] + z[0]*dt
+        return [[z[1], 0, sol.t_events[0][0]], dx.tolist(), dt.tolist()]
+
     def time_x(self, x, air=False):
         """Return time for this body to reach a distance x as a scalar. Set air=True to apply air resistance.
         Return None if no solution is found."""
@@ -233,9 +670,23 @@ class Tr:
                 return 0
             elif t < 0:
                 return None
-            if air:
+            k = Tr.__analytic_k(self) if air else None
+            if k is not None and k*abs(x - x0) < 700:  # flat fire, t_flat overflows for targets out of reach
+                t_flat = math.expm1(k*abs(x - x0))/(k*abs(v0x))
+                if Tr.__analytic_state(self, self.init_vel, t_flat) is not None:
+                    return t_flat
+            if air and self.cache is not None:
+                flight = Tr.__flight(self)
+                t_x = flight.crossing(1, x)  # x may be passed more than once, e.g. in a headwind
+                if t_x is None:  # x is not reached yet
+                    reach = lambda t, r, *args: x - r[1]
+                    reach.terminal = True
+                    flight.extend(t*10, reach)
+                    t_x = flight.crossing(1, x)
+                return t_x
+            elif air:
                 sol = Tr.__ode_solver_reach_x(self, x, [v0x, v0y], t*10)
-                if not sol.t_events[0]:  # no solution was found
+                if len(sol.t_events[0]) == 0:  # no solution was found
                     return None
                 last = len(sol.t) - 1
                 t = sol.t[last]
@@ -248,30 +699,1944 @@ class Tr:
         p = Tr.landing_point(self, air)
         return p[2]
 
-    def add_plot(self, t, air=False, c="red", res=100):
+    def __ranges(self, speed, back=False):
+        """Return a function of the launch angle in degrees that returns the distance travelled with air resistance at
+        initial speed, 0 if the body never lands. Set back=True to launch at 180° minus the angle instead and measure
+        the distance towards -x. Every distance is integrated once."""
+        Tr.__drag(self)  # RuntimeError if drag properties are missing
+        ranges = {}
+
+        def f(a):
+            if a not in ranges:
+                b = (180 - a if back else a)*math.pi/180
+                try:
+                    p = Tr.landing_point(self, True, [speed*math.cos(b), speed*math.sin(b)])
+                except RuntimeError:  # body never lands
+                    p = None
+                ranges[a] = 0 if p is None or p[2] == 0 else (p[0] - self.init_pos[0])*(-1 if back else 1)
+            return ranges[a]
+        return f
+
+    def optimal_angle(self, speed, air=False, tol=0.01):
+        """Return the launch angle in degrees that gives this body the longest range towards +x at initial speed, and
+        the x-coordinate of the landing point, as a list [a, x]. Set air=True to apply air resistance, the angle is then
+        found to within tol degrees by Brent's method. RuntimeError is raised if no solution is found."""
+        g = Tr.__gravity(self)
+        x0 = self.init_pos[0]
+        y0 = self.init_pos[1]
+        if speed**2 + 2*g*y0 < 0:  # body never lands
+            raise RuntimeError("No real solution was found.")
+        if not air:
+            a = math.atan2(speed, (speed**2 + 2*g*y0)**0.5)
+            v0x = speed*math.cos(a)
+            v0y = speed*math.sin(a)
+            return [a*180/math.pi, x0 + v0x*(v0y/g + ((v0y/g)**2 + 2*y0/g)**0.5)]
+        from scipy.optimize import minimize_scalar
+        f = Tr.__ranges(self, speed)
+        a = minimize_scalar(lambda a: -f(a), bounds=(-90 if y0 > 0 else 0, 90), method="bounded",
+                            options={"xatol": tol}).x
+        return [a, x0 + f(a)]
+
+    def angles_for_range(self, x, speed, air=False, tol=0.001):
+        """Return the low and high launch angles in degrees at which this body with initial speed lands at a distance
+        x as a list [a_low, a_high]. Angles are measured from the +x axis, so they are above 90° for x behind the body.
+        Set air=True to apply air resistance. Set a lower tolerance tol to get a more precise answer. RuntimeError is
+        raised if x is out of reach."""
+        g = Tr.__gravity(self)
+        x0 = self.init_pos[0]
+        y0 = self.init_pos[1]
+        d = abs(x - x0)
+        if not air:
+            root = speed**4 - g*(g*d**2 - 2*y0*speed**2)
+            if root < 0:
+                raise RuntimeError("No real solution was found. The distance is out of reach.")
+            a = [math.atan2(speed**2 - root**0.5, g*d)*180/math.pi, math.atan2(speed**2 + root**0.5, g*d)*180/math.pi]
+        else:
+            f = Tr.__ranges(self, speed, x < x0)  # wind breaks the symmetry of targets behind the body
+            lo = -90 if y0 > 0 else 0
+            c = _find_max(f, lo, 90, 1e-6, d)  # splits the low and the high solution
+            if d - f(c) > tol*d:
+                raise RuntimeError("No real solution was found. The distance is out of reach.")
+            error = lambda a: f(a) - d
+            if f(c) < d:  # maximum range
+                a = [c, c]
+            else:
+                a = [_find_root(error, lo, c, tol*d, tol), _find_root(error, c, 90, tol*d, tol)]
+        if x < x0:
+            a = [180 - a[0], 180 - a[1]]
+        return a
+
+    def summary(self, air=False, x_targets=(), y_targets=()):
+        """Return the events of the flight of this body until impact, computed with at most one integration, as a
+        dictionary. Every event is given as a state [t, x, y, vx, vy]: "apex" and "impact" as for max_alt and
+        landing_point, "x" with one state (or None) per distance in x_targets and "y" with a list of the crossings of
+        each altitude in y_targets. Set air=True to apply air resistance.
+        RuntimeError is raised if the body never lands."""
+        g = Tr.__gravity(self)
+        x0 = self.init_pos[0]
+        y0 = self.init_pos[1]
+        v0x = self.init_vel[0]
+        v0y = self.init_vel[1]
+        t_imp_no_air = v0y / g + ((v0y / g) ** 2 + 2 * y0 / g) ** 0.5  # only biggest solution
+        if type(t_imp_no_air) is complex:  # body never lands
+            raise RuntimeError("No real solution was found. It seems like this body never lands.")
+        state = lambda t, r: [t, r[1], r[3], r[0], r[2]]
+        if not air or t_imp_no_air == 0:
+            closed = lambda t: [t] + Tr.pos(self, t) + Tr.v(self, t)
+            t_apex = max(v0y/g, 0)
+            apex = closed(t_apex) if t_apex <= t_imp_no_air else None
+            x_events = []
+            for x in x_targets:
+                if v0x != 0:
+                    t = (x - x0) / v0x
+                else:
+                    t = 0 if x == x0 else -1
+                x_events.append(closed(t) if 0 <= t <= t_imp_no_air else None)
+            y_events = []
+            for y in y_targets:
+                d = v0y**2 + 2*g*(y0 - y)
+                roots = sorted(set([(v0y - d**0.5)/g, (v0y + d**0.5)/g])) if d >= 0 else []
+                y_events.append([closed(t) for t in roots if 0 <= t <= t_imp_no_air])
+            return {"apex": apex, "impact": closed(t_imp_no_air), "x": x_events, "y": y_events}
+
+        hit = lambda t, r, *args: r[3]
+        hit.terminal = True
+        hit.direction = -1
+        top = lambda t, r, *args: r[2]
+        top.direction = -1
+        events = [hit, top]
+        events += [lambda t, r, *args, x=x: x - r[1] for x in x_targets]
+        events += [lambda t, r, *args, y=y: y - r[3] for y in y_targets]
+        sol = Tr.__solve(self, self.init_vel, t_imp_no_air*10, events)
+        found = [[state(t, r) for t, r in zip(te, ye)] for te, ye in zip(sol.t_events, sol.y_events)]
+        if v0y <= 0:  # body is dropped
+            apex = state(0, [v0x, x0, v0y, y0])
+        else:
+            apex = found[1][0] if found[1] else None
+        x_events = [e[0] if e else None for e in found[2:2 + len(x_targets)]]
+        y_events = found[2 + len(x_targets):]
+        return {"apex": apex, "impact": found[0][0] if found[0] else None, "x": x_events, "y": y_events}
+
+    def sample(self, t_end, n=100, air=False):
+        """Return n evenly spaced samples of the state of this body from time t=0 to t_end as a list of NumPy arrays
+        [t, x, y, vx, vy]. Set air=True to apply air resistance, in which case the trajectory is integrated only once."""
+        g = Tr.__gravity(self)
+        t = np.linspace(0, t_end, n)
+        x0 = self.init_pos[0]
+        y0 = self.init_pos[1]
+        v0x = self.init_vel[0]
+        v0y = self.init_vel[1]
+        if not air:
+            x = v0x * t + x0
+            y = -g * t ** 2 / 2 + v0y * t + y0
+            vx = np.full_like(t, v0x)
+            vy = -g * t + v0y
+        elif t_end == 0:  # solve_ivp returns no states for an empty interval
+            x, y, vx, vy = (np.full_like(t, q) for q in (x0, y0, v0x, v0y))
+        else:
+            sol = Tr.__ode_solver(self, t_end, t)
+            vx, x, vy, y = sol.y
+        return [t, x, y, vx, vy]
+
+    def iter_states(self, t_end, dt, air=False, chunk_size=1024):
+        """Yield the state of this body at times t=0, dt, 2*dt, ... up to t_end in chunks of at most chunk_size samples,
+        each a list of NumPy arrays [t, x, y, vx, vy]. Set air=True to apply air resistance, in which case the samples
+        are produced while the integration advances step by step, so memory use does not depend on t_end or dt."""
+        g = Tr.__gravity(self)
+        n = int(t_end/dt + 1e-9) + 1
+        x0 = self.init_pos[0]
+        y0 = self.init_pos[1]
+        v0x = self.init_vel[0]
+        v0y = self.init_vel[1]
+        if not air:
+            for i in range(0, n, chunk_size):
+                t = np.arange(i, min(i + chunk_size, n))*dt
+                yield [t, v0x * t + x0, -g * t ** 2 / 2 + v0y * t + y0, np.full_like(t, v0x), -g * t + v0y]
+            return
+
+        import scipy.integrate
+        rhs, jac, args, k = Tr.__ode(self)
+        options = {"rtol": self.rtol, "atol": self.atol}
+        if self.method in _implicit_methods:
+            options["jac"] = lambda t, r: jac(t, r, *args)
+        fun = lambda t, r: rhs(t, r, *args)
+        cancellation = getattr(_local, "cancellation", None)  # stepped here instead of in solve(), so the same as there
+        if cancellation is not None:
+            fun = _cancellable(fun, cancellation)
+        counts = {"steps": 0, "rejected": None, "time": 0.0}
+        counted = bool(_listeners)
+        base = _counting_solver(self.method, counts) if counted else getattr(scipy.integrate, self.method)
+        solver = base(fun, 0, [v0x, x0, v0y, y0], t_end, **options)
+        buf = np.empty((5, chunk_size))
+        m = 0  # samples in buf
+        i = 0  # index of the next sample
+        j = 1  # index after the last sample covered by the current step
+        state = lambda t: np.array([[v0x], [x0], [v0y], [y0]], dtype=float)
+        try:
+            while i < n:
+                while i < j:
+                    take = min(chunk_size - m, j - i)
+                    t = np.arange(i, i + take)*dt
+                    r = state(t).reshape(4, -1)
+                    buf[0, m:m + take] = t
+                    buf[1, m:m + take] = r[1]
+                    buf[2, m:m + take] = r[3]
+                    buf[3, m:m + take] = r[0]
+                    buf[4, m:m + take] = r[2]
+                    m += take
+                    i += take
+                    if m == chunk_size:
+                        yield list(buf.copy())
+                        m = 0
+                if i < n:
+                    start = time.perf_counter()
+                    msg = solver.step()
+                    counts["time"] += time.perf_counter() - start
+                    if solver.status == "failed":
+                        raise RuntimeError(msg)
+                    j = n if solver.status == "finished" else min(n, int(solver.t/dt + 1e-9) + 1)
+                    state = solver.dense_output()
+            if m > 0:
+                yield list(buf[:, :m].copy())
+        finally:
+            if counted:  # also when the caller stops early
+                _emit({"kind": "solve", "method": self.method, "time": counts["time"], "nfev": int(solver.nfev),
+                       "njev": int(solver.njev), "steps": counts["steps"], "rejected": counts["rejected"],
+                       "status": -1 if solver.status == "failed" else 0})
+
+    def __copy(self):
+        body = Tr()
+        for name in Tr.__slots__:
+            setattr(body, name, getattr(self, name))
+        body.init_pos = list(self.init_pos)
+        body.init_vel = list(self.init_vel)
+        body.cache = None  # the copy may be sent to another process
+        return body
+
+    async def __run(self, f, args, timeout):
+        key = (f.__name__, Tr.__key(self, self.init_vel), self.analytic, _hashable(args))
+        return await _run(key, f, (Tr.__copy(self),) + args, timeout)
+
+    async def apos(self, t, air=False, timeout=None):
+        """Asynchronous pos. With air resistance the integration runs in the module's executor (the event loop's
+        default executor if it is None), a thread or process pool, on a copy of this body without cache. Identical
+        requests in flight share one integration, which is stopped once all of them are cancelled or have exceeded
+        timeout seconds. In a process pool, an integration that has already started runs to the end.
+        asyncio.TimeoutError is raised on timeout."""
+        if not air:
+            return Tr.pos(self, t)
+        return await Tr.__run(self, Tr.pos, (t, air), timeout)
+
+    async def av(self, t, air=False, timeout=None):
+        """Asynchronous v, see apos."""
+        if not air:
+            return Tr.v(self, t)
+        return await Tr.__run(self, Tr.v, (t, air), timeout)
+
+    async def amax_alt(self, air=False, timeout=None):
+        """Asynchronous max_alt, see apos."""
+        if not air:
+            return Tr.max_alt(self)
+        return await Tr.__run(self, Tr.max_alt, (air,), timeout)
+
+    async def alanding_point(self, air=False, v0=None, timeout=None):
+        """Asynchronous landing_point, see apos."""
+        if not air:
+            return Tr.landing_point(self, air, v0)
+        return await Tr.__run(self, Tr.landing_point, (air, v0), timeout)
+
+    async def atime_x(self, x, air=False, timeout=None):
+        """Asynchronous time_x, see apos."""
+        if not air:
+            return Tr.time_x(self, x)
+        return await Tr.__run(self, Tr.time_x, (x, air), timeout)
+
+    async def ai_vel(self, x, a, air=False, tol=0.001, method="secant", full_output=False, timeout=None):
+        """Asynchronous i_vel, see apos."""
+        if not air:
+            return Tr.i_vel(self, x, a, air, tol, method, full_output)
+        return await Tr.__run(self, Tr.i_vel, (x, a, air, tol, method, full_output), timeout)
+
+    def add_plot(self, t, air=False, c="red", res=100, ax=None):
         """Add a plot of the trajectory of this body from time t=0 to t. Set air=True to apply air resistance.
         Set line color with argument c as a string. Set a higher resolution res to get a more precise result.
-        Call show_plot() to show the plot. Return None."""
-        h = t/res
-        t_val = []
-        i = 0
-        while i <= t:
-            t_val.append(i)
-            i += h
-        x_points = []
-        y_points = []
-        for j in t_val:
-            p = Tr.pos(self, j, air)
-            x_points.append(p[0])
-            y_points.append(p[1])
-
-        plt.plot(x_points, y_points, linewidth=1, color=c)
-        plt.title("Trajectory from t=0 to t")
-        plt.xlabel("x")
-        plt.ylabel("y")
+        Set ax to a matplotlib Axes to draw on it, by default pyplot's current axes are used, which are shared by
+        every thread. Call show_plot() to show the plot. Return None."""
+        s = Tr.sample(self, t, res + 1, air)
+        if ax is None:
+            ax = _pyplot().gca()
+        ax.plot(s[1], s[2], linewidth=1, color=c)
+        ax.set_title("Trajectory from t=0 to t")
+        ax.set_xlabel("x")
+        ax.set_ylabel("y")
+        return None
+
+    def show_plot(self):
+        """Show plots added with add_plot. Return None."""
+        _pyplot().show()
+        return None
+
+def _find_root(f, a, b, tol, rtol, method="secant", max_iter=100):
+    """Return a root c of f in [a, b] with abs(f(c)) <= tol. The brent method instead stops when c is known to a
+    relative precision rtol/2. RuntimeError is raised if no root is found."""
+    if method not in ("secant", "brent", "bisect"):
+        raise ValueError("Unknown root finding method: " + str(method))
+    if method == "bisect":
+        fa = None
+        for i in range(max_iter):
+            c = (a+b)/2
+            fc = f(c)
+            if abs(fc) <= tol:
+                return c
+            if fa is None:
+                fa = f(a)
+            if fa*fc < 0:
+                b = c
+            else:
+                a = c
+                fa = fc
+        raise RuntimeError("No real solution was found.")
+    fa = f(a)
+    if abs(fa) <= tol:
+        return a
+    fb = f(b)
+    if abs(fb) <= tol:
+        return b
+    if fa*fb > 0:  # no sign change to bracket, fall back to bisection
+        return _find_root(f, a, b, tol, rtol, "bisect", max_iter)
+    if method == "brent":
+        from scipy.optimize import brentq
+        return brentq(f, a, b, rtol=max(rtol/2, 4*np.finfo(float).eps), maxiter=max_iter)
+    for i in range(max_iter):  # Illinois variant of regula falsi
+        c = b - fb*(b - a)/(fb - fa)
+        fc = f(c)
+        if abs(fc) <= tol:
+            return c
+        if fc*fb < 0:
+            a = b
+            fa = fb
+        else:
+            fa = fa/2
+        b = c
+        fb = fc
+    raise RuntimeError("No real solution was found.")
+
+
+def _find_max(f, a, b, tol, stop=math.inf):
+    """Return c in [a, b] where f, which has a single maximum in [a, b], is largest to within tol by golden-section
+    search. The search ends early at the first c with f(c) >= stop."""
+    r = (math.sqrt(5) - 1)/2
+    c = b - r*(b - a)
+    d = a + r*(b - a)
+    fc = f(c)
+    fd = f(d)
+    while b - a > tol and max(fc, fd) < stop:
+        if fc > fd:  # maximum in [a, d]
+            b, d, fd = d, c, fc
+            c = b - r*(b - a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + r*(b - a)
+            fd = f(d)
+    return c if fc >= fd else d
+
+
+class SolutionCache:
+    """Least recently used cache of trajectories integrated with air resistance. Attach it to one or more bodies as
+    Tr.cache. Entries are keyed on every property of the body, so changing a body never returns a stale trajectory.
+    The numbers of cache hits and misses are counted in hits and misses. A cache may be shared between threads."""
+
+    def __init__(self, maxsize=128):
+        """Initialize an empty cache holding at most maxsize trajectories."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__data)
+
+    def get(self, key):
+        """Return the trajectory stored for key, or None."""
+        with self.__lock:
+            flight = self.__data.get(key)
+            if flight is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.__data.move_to_end(key)
+        if _listeners:
+            _emit({"kind": "cache", "hit": flight is not None})
+        return flight
+
+    def put(self, key, flight):
+        """Store a trajectory for key, evicting the least recently used one if the cache is full. Return None."""
+        with self.__lock:
+            self.__data[key] = flight
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+        return None
+
+    def clear(self):
+        """Remove all trajectories and reset the counters. Return None."""
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.misses = 0
+        return None
+
+
+class _Flight:
+    """Dense solution of the drag ODE of one body from t=0, extended on demand. Impact and highest altitude are
+    recorded as [t, state] the first time they are passed. Bodies in several threads may extend the same flight, one
+    at a time."""
+
+    def __init__(self, r0, fun, args, options):
+        self.fun = fun
+        self.args = args
+        self.options = options
+        self.segments = []
+        self.t_end = 0
+        self.r_end = np.asarray(r0, dtype=float)
+        self.impact = None
+        self.apex = None
+        self.lock = threading.Lock()
+
+    def extend(self, t_max, stop=None):
+        """Integrate up to t_max, or until stop is reached. stop is "impact", "apex" or a terminal event function."""
+        with self.lock:
+            return _Flight.__extend(self, t_max, stop)
+
+    def __extend(self, t_max, stop):
+        if t_max <= self.t_end:
+            return None
+        hit = lambda t, r, *args: r[3]
+        hit.direction = -1
+        hit.terminal = stop == "impact"
+        top = lambda t, r, *args: r[2]
+        top.direction = -1
+        top.terminal = stop == "apex"
+        events = [hit, top]
+        if callable(stop):
+            events.append(stop)
+        sol = solve(self.fun, [self.t_end, t_max], self.r_end, dense_output=True, events=events, args=self.args,
+                    **self.options)
+        if self.impact is None and len(sol.t_events[0]) > 0:
+            self.impact = [sol.t_events[0][0], sol.y_events[0][0]]
+        if self.apex is None and len(sol.t_events[1]) > 0:
+            self.apex = [sol.t_events[1][0], sol.y_events[1][0]]
+        self.segments.append(sol.sol)  # before t_end, so that every t <= t_end is covered by a segment
+        self.r_end = sol.y[:, -1]
+        self.t_end = sol.t[-1]
+        return None
+
+    def crossing(self, i, value):
+        """Return the first time at which component i of the state passes value in the integrated part of the flight,
+        or None if it does not. As with solve_ivp events, a double crossing within one step is not detected."""
+        for segment in self.segments:
+            d = segment(segment.ts)[i] - value
+            steps = np.flatnonzero(d[:-1]*d[1:] <= 0)
+            if len(steps) > 0:
+                k = steps[0]
+                return _find_root(lambda t: segment(t)[i] - value, segment.ts[k], segment.ts[k + 1], 0, 1e-12, "brent")
+        return None
+
+    def __call__(self, t):
+        for segment in self.segments:
+            if t <= segment.t_max:
+                return segment(t)
+        return self.r_end
+
+
+# Dormand-Prince 5(4) coefficients used by the lock-step integrator of TrBatch.
+_DP_A = [[1/5],
+         [3/40, 9/40],
+         [44/45, -56/15, 32/9],
+         [19372/6561, -25360/2187, 64448/6561, -212/729],
+         [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]]
+_DP_B = [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]
+_DP_E = [-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40]
+
+
+def _unpack_state(pos, vel, dims):
+    """Return the coordinates of the positions pos followed by those of the velocities vel, arrays of shape (n, dims)
+    or (dims,), as arrays of one value per body."""
+    pos = np.asarray(pos, dtype=float)
+    vel = np.asarray(vel, dtype=float)
+    return np.broadcast_arrays(*(np.atleast_1d(q[..., i]) for q in (pos, vel) for i in range(dims)))
+
+
+def _drag_factor(c, area, mass):
+    """Return the drag factors 0.5*c*area/mass of bodies as an array. RuntimeError is raised unless all of them are
+    positive."""
+    if c is None or area is None or mass is None:
+        k = np.zeros(1)
+    else:
+        k = 0.5*np.asarray(c, dtype=float)*np.asarray(area, dtype=float)/np.asarray(mass, dtype=float)
+    if not np.all(k > 0):
+        raise RuntimeError("Reference area, mass and drag coefficient have to be provided to "
+                           "perform this operation")
+    return k
+
+
+def _drag_rhs(r, k, env=None, magnus=None):
+    """Return the time derivative of the state r = [vx, x, vy, y] of a body with drag factor k = 0.5*p*c*area/mass.
+    r may hold one body per column, in which case k is an array with one value per body. With an Environment env,
+    k = 0.5*c*area/mass and the gravity, air density and wind of env are used. States [vx, x, vy, y, vz, z] of 3D
+    bodies are passed on to _drag_rhs_3d with magnus."""
+    if len(r) == 6:
+        return _drag_rhs_3d(r, k, env, magnus)
+    if env is None:
+        s = np.sqrt(r[0]**2 + r[2]**2)
+        return np.array([-k*r[0]*s, r[0], -k*r[2]*s - g, r[2]])
+    ux = r[0] - env.wind[0]
+    uy = r[2] - env.wind[1]
+    ks = k*env.density_at(r[3])*np.sqrt(ux**2 + uy**2)
+    return np.array([-ks*ux, r[0], -ks*uy - env.g, r[2]])
+
+
+def _drag_rhs_3d(r, k, env, magnus):
+    """Return the time derivative of the state r = [vx, x, vy, y, vz, z] of 3D bodies with drag factor
+    k = 0.5*c*area/mass, one column and one value per body. magnus holds the spin vectors of the bodies scaled by
+    0.5*area*radius*cl/mass as rows [mx, my, mz], or is None for bodies without spin. The Magnus acceleration is
+    density*(magnus × u) for the velocity u relative to the air."""
+    if env is None:
+        density, gravity, wx, wy, wz = p, g, 0, 0, 0
+    else:
+        density, gravity = env.density_at(r[3]), env.g
+        wx, wy, wz = (tuple(env.wind) + (0,))[:3]
+    ux = r[0] - wx
+    uy = r[2] - wy
+    uz = r[4] - wz
+    ks = k*density*np.sqrt(ux**2 + uy**2 + uz**2)
+    ax = -ks*ux
+    ay = -ks*uy - gravity
+    az = -ks*uz
+    if magnus is not None:
+        mx, my, mz = density*magnus
+        ax += my*uz - mz*uy
+        ay += mz*ux - mx*uz
+        az += mx*uy - my*ux
+    return np.array([ax, r[0], ay, r[2], az, r[4]])
+
+
+def _sensitivity_rhs(t, z, rhs, jac, args, g, mass, c):
+    """Return the time derivative of z = [vx, x, vy, y, s], where s holds the derivatives of the state with respect
+    to initial speed, angle, mass and drag coefficient as a 4x4 matrix row by row, for the drag ODE rhs with Jacobian
+    jac and their extra arguments args."""
+    r = z[:4]
+    f = np.asarray(rhs(t, r, *args), dtype=float)
+    drag = f - [0, r[0], -g, r[2]]  # proportional to the drag factor, that is to c/mass
+    ds = jac(t, r, *args) @ z[4:].reshape(4, 4)
+    ds[:, 2] -= drag/mass
+    ds[:, 3] += drag/c
+    return np.concatenate([f, ds.ravel()])
+
+
+def _drag_rhs_1(t, r, k, g):
+    """Return the time derivative of the state r = [vx, x, vy, y] of one body as a list. This is the right-hand side
+    passed to solve_ivp, with drag factor k = 0.5*p*c*area/mass and gravity g as extra arguments."""
+    vx, x, vy, y = r.tolist()
+    ks = k*math.sqrt(vx*vx + vy*vy)
+    return [-ks*vx, vx, -ks*vy - g, vy]
+
+
+def _drag_rhs_1_array(t, r, k, g):
+    vx = r[0]
+    vy = r[2]
+    ks = k*math.sqrt(vx*vx + vy*vy)
+    f = np.empty(4)
+    f[0] = -ks*vx
+    f[1] = vx
+    f[2] = -ks*vy - g
+    f[3] = vy
+    return f
+
+
+def _drag_jac(t, r, k, g):
+    """Return the Jacobian of _drag_rhs_1 with respect to the state r as a 4x4 array."""
+    vx = r[0]
+    vy = r[2]
+    s = math.sqrt(vx*vx + vy*vy)
+    j = np.zeros((4, 4))
+    if s > 0:
+        j[0, 0] = -k*(s + vx*vx/s)
+        j[0, 2] = -k*vx*vy/s
+        j[2, 0] = -k*vx*vy/s
+        j[2, 2] = -k*(s + vy*vy/s)
+    j[1, 0] = 1
+    j[3, 2] = 1
+    return j
+
+
+# solve_ivp methods that use the Jacobian
+_implicit_methods = ("Radau", "BDF", "LSODA")
+
+# backend of the single body kernel, "numba" or "python", decided on the first integration
+kernel_backend = None
+_kernel = None
+_kernel_lock = threading.Lock()
+
+
+def _drag_kernel():
+    """Return right-hand side and Jacobian of the drag ODE of one body for solve_ivp. They are compiled with Numba
+    on first use when it is installed."""
+    global _kernel, kernel_backend
+    if _kernel is None:
+        with _kernel_lock:  # compile once, and set kernel_backend before other threads see the kernel
+            if _kernel is None:
+                try:
+                    import numba
+                except ImportError:
+                    kernel_backend = "python"
+                    _kernel = (_drag_rhs_1, _drag_jac)
+                else:
+                    kernel = (numba.njit(cache=True)(_drag_rhs_1_array), numba.njit(cache=True)(_drag_jac))
+                    kernel_backend = "numba"
+                    _kernel = kernel
+    return _kernel
+
+
+def _logcosh(a):
+    a = abs(a)
+    return a + math.log1p(math.exp(-2*a)) - math.log(2)
+
+
+def _logsinh(a):
+    return a + math.log1p(-math.exp(-2*a)) - math.log(2)
+
+
+def _vertical_state(vy0, y0, k, g, t):
+    """Return [vy, y] at time t of a body moving straight up or down with drag factor k. The solution is exact:
+    tan while rising, then tanh (or coth above terminal speed) while falling."""
+    vt = math.sqrt(g/k)  # terminal speed
+    tau = vt/g
+    h = vt*vt/g
+    if vy0 > 0:
+        phi = math.atan(vy0/vt)
+        if t <= tau*phi:
+            return [vt*math.tan(phi - t/tau), y0 + h*math.log(math.cos(phi - t/tau)/math.cos(phi))]
+        y0 = y0 - h*math.log(math.cos(phi))  # apex
+        t = t - tau*phi
+        vy0 = 0
+    u0 = -vy0
+    if u0 < vt:
+        phi = math.atanh(u0/vt)
+        return [-vt*math.tanh(t/tau + phi), y0 - h*(_logcosh(t/tau + phi) - _logcosh(phi))]
+    if u0 > vt:
+        psi = math.atanh(vt/u0)
+        return [-vt/math.tanh(t/tau + psi), y0 - h*(_logsinh(t/tau + psi) - _logsinh(psi))]
+    return [-vt, y0 - vt*t]
+
+
+def _vertical_apex_time(vy0, k, g):
+    """Return the time at which a body moving straight up with drag factor k stops rising."""
+    vt = math.sqrt(g/k)
+    return vt/g*math.atan(vy0/vt)
+
+
+def _vertical_impact(vy0, y0, k, g):
+    """Return the time at which a body moving straight up or down with drag factor k falls through y=0, or None if
+    it never gets above y=0."""
+    vt = math.sqrt(g/k)
+    tau = vt/g
+    h = vt*vt/g
+    t = 0
+    if vy0 > 0:
+        phi = math.atan(vy0/vt)
+        t = tau*phi
+        y0 = y0 - h*math.log(math.cos(phi))
+        vy0 = 0
+    if y0 <= 0:
+        return None
+    u0 = -vy0
+    if u0 < vt:
+        phi = math.atanh(u0/vt)
+        a = _logcosh(phi) + y0/h
+        return t + tau*(a + math.log1p(math.sqrt(-math.expm1(-2*a))) - phi)  # acosh(exp(a))
+    if u0 > vt:
+        psi = math.atanh(vt/u0)
+        a = _logsinh(psi) + y0/h
+        return t + tau*(a + math.log1p(math.sqrt(1 + math.exp(-2*a))) - psi)  # asinh(exp(a))
+    return t + y0/vt
+
+
+def _flat_state(v0x, v0y, x0, y0, k, g, t):
+    """Return the state [vx, x, vy, y] at time t in the flat-fire approximation, where the speed in the drag is
+    replaced by the horizontal speed. This underestimates the drag by less than rtol while |vy/vx| stays below
+    sqrt(rtol*(2 + rtol)), and the position is then off by less than rtol times the distance travelled."""
+    a = k*abs(v0x)
+    e = a*t
+    w = 1 + e
+    ln_w = math.log1p(e)
+    if e < 1e-3:  # series of ln_w - e - e²/2, which cancels
+        d = e*e*(-1 + e*(1/3 + e*(-1/4 + e*(1/5 - e/6))))
+    else:
+        d = ln_w - e - e*e/2
+    x = x0 + math.copysign(ln_w/k, v0x)
+    y = y0 + v0y*ln_w/a + g*d/(2*a*a)
+    return [v0x/w, x, (v0y - g*t*(1 + e/2))/w, y]
+
+
+def _flat_apex_time(v0x, v0y, k, g):
+    """Return the time at which vy is 0 in the flat-fire approximation."""
+    return 2*v0y/(g*(1 + math.sqrt(1 + 2*k*abs(v0x)*v0y/g)))
+
+
+def _flat_impact(v0x, v0y, x0, y0, k, g, t):
+    """Return [t, state] at which y falls through 0 in the flat-fire approximation, found with Newton's method
+    starting at time t, or None if it does not converge."""
+    for _ in range(50):
+        r = _flat_state(v0x, v0y, x0, y0, k, g, t)
+        if r[2] >= 0:
+            return None
+        dt = r[3]/r[2]
+        t = t - dt
+        if t <= 0:
+            return None
+        if abs(dt) <= 1e-12*t:
+            return [t, _flat_state(v0x, v0y, x0, y0, k, g, t)]
+    return None
+
+
+def _table_density(density, dy, y):
+    """Return the air density at height y interpolated linearly from the table density at heights 0, dy, 2*dy, ...
+    and held constant outside of it, and its derivative with respect to y, as a tuple. Shared by the kernels of
+    _drag_env_kernel, and compiled with them."""
+    s = y/dy
+    n = len(density) - 1
+    if s <= 0:
+        return density[0], 0.0
+    if s >= n:
+        return density[n], 0.0
+    i = int(s)
+    slope = (density[i + 1] - density[i])/dy
+    return density[i] + slope*(y - i*dy), slope
+
+
+def _drag_rhs_env(t, r, k, g, wx, wy, density, dy):
+    """Return the time derivative of the state r = [vx, x, vy, y] of one body as a list, with the drag relative to the
+    wind [wx, wy] and the air density interpolated from the table density at heights 0, dy, 2*dy, ...
+    The drag factor is k = 0.5*c*area/mass."""
+    vx, x, vy, y = r.tolist()
+    rho = _table_density(density, dy, y)[0]
+    ux = vx - wx
+    uy = vy - wy
+    ks = k*rho*math.sqrt(ux*ux + uy*uy)
+    return [-ks*ux, vx, -ks*uy - g, vy]
+
+
+def _drag_rhs_env_array(t, r, k, g, wx, wy, density, dy):
+    rho = _table_density(density, dy, r[3])[0]
+    ux = r[0] - wx
+    uy = r[2] - wy
+    ks = k*rho*math.sqrt(ux*ux + uy*uy)
+    f = np.empty(4)
+    f[0] = -ks*ux
+    f[1] = r[0]
+    f[2] = -ks*uy - g
+    f[3] = r[2]
+    return f
+
+
+def _drag_jac_env(t, r, k, g, wx, wy, density, dy):
+    """Return the Jacobian of _drag_rhs_env with respect to the state r as a 4x4 array."""
+    rho, slope = _table_density(density, dy, r[3])
+    ux = r[0] - wx
+    uy = r[2] - wy
+    u = math.sqrt(ux*ux + uy*uy)
+    j = np.zeros((4, 4))
+    if u > 0:
+        j[0, 0] = -k*rho*(u + ux*ux/u)
+        j[0, 2] = -k*rho*ux*uy/u
+        j[2, 0] = -k*rho*ux*uy/u
+        j[2, 2] = -k*rho*(u + uy*uy/u)
+    j[0, 3] = -k*slope*u*ux
+    j[2, 3] = -k*slope*u*uy
+    j[1, 0] = 1
+    j[3, 2] = 1
+    return j
+
+
+_env_kernel = None
+
+
+def _drag_env_kernel():
+    """Return right-hand side and Jacobian of the drag ODE of one body with wind and varying air density, compiled
+    with Numba like _drag_kernel. The density table is passed as a list, or as an array with Numba."""
+    global _env_kernel
+    if _env_kernel is None:
+        _drag_kernel()
+        with _kernel_lock:
+            if _env_kernel is None:
+                if kernel_backend == "numba":
+                    import numba
+                    from numba.extending import register_jitable
+                    register_jitable(_table_density)  # callable from the compiled kernels
+                    _env_kernel = (numba.njit(cache=True)(_drag_rhs_env_array), numba.njit(cache=True)(_drag_jac_env))
+                else:
+                    _env_kernel = (_drag_rhs_env, _drag_jac_env)
+    return _env_kernel
+
+
+def _dp_step(r, k, h, f0, env=None, magnus=None):
+    """Take one Dormand-Prince step of size h (one per column) from state r with derivative f0.
+    Return the new state, its local error estimate and the derivative at the new state."""
+    K = [f0]
+    for a in _DP_A:
+        K.append(_drag_rhs(r + h*sum(ai*Ki for ai, Ki in zip(a, K) if ai), k, env, magnus))
+    r_new = r + h*sum(b*Ki for b, Ki in zip(_DP_B, K) if b)
+    K.append(_drag_rhs(r_new, k, env, magnus))
+    err = h*sum(e*Ki for e, Ki in zip(_DP_E, K) if e)
+    return r_new, err, K[-1]
+
+
+def _rms(a):
+    return np.sqrt(np.mean(a**2, axis=0))
+
+
+def _integrate_batch(r0, k, t_end, event=None, target=0, direction=0, rtol=1e-6, atol=1e-9, max_steps=100000,
+                     env=None, magnus=None):
+    """Integrate the drag ODE for every column of r0 from t=0 to t_end. All bodies advance in lock-step, each with its
+    own adaptive step size. If event is the index of a state component, a body stops as soon as that component crosses
+    target (only downwards if direction=-1). k, env and magnus (one column per body) are passed to _drag_rhs.
+    Return final times, final states and a boolean array that is True for every body that reached its event."""
+    n = r0.shape[1]
+    k = np.broadcast_to(k, n)
+    t_end = np.array(np.broadcast_to(t_end, n), dtype=float)
+    target = np.broadcast_to(target, n)
+    t = np.zeros(n)
+    r = np.array(r0, dtype=float)
+    f = _drag_rhs(r, k, env, magnus)
+    hit = np.zeros(n, dtype=bool)
+    active = t_end > 0
+    start = time.perf_counter()
+    nfev = n  # right-hand side evaluations, counted per body
+    steps = 0
+    rejected = 0
+
+    # initial step size as suggested by Hairer, Nørsett & Wanner
+    scale = atol + rtol*np.abs(r)
+    d0 = _rms(r/scale)
+    d1 = _rms(f/scale)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h = np.where((d0 < 1e-5) | (d1 < 1e-5), 1e-6, 0.01*d0/d1)
+
+    for _ in range(max_steps):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        ri = r[:, idx]
+        ki = k[idx]
+        fi = f[:, idx]
+        mi = None if magnus is None else magnus[:, idx]
+        left = t_end[idx] - t[idx]
+        hi = np.minimum(h[idx], left)
+        r_new, err, f_new = _dp_step(ri, ki, hi, fi, env, mi)
+        nfev += 6*idx.size
+
+        scale = atol + rtol*np.maximum(np.abs(ri), np.abs(r_new))
+        err_norm = _rms(err/scale)
+        ok = err_norm <= 1
+        steps += np.count_nonzero(ok)
+        rejected += idx.size - np.count_nonzero(ok)
+        with np.errstate(divide="ignore"):
+            factor = np.clip(0.9*err_norm**-0.2, 0.2, 10)
+        h[idx] = hi*np.where(ok, factor, np.minimum(factor, 1))
+
+        if event is not None:
+            e_old = ri[event] - target[idx]
+            e_new = r_new[event] - target[idx]
+            crossed = ok & (e_old > 0) & (e_new <= 0)
+            if direction == 0:
+                crossed |= ok & (e_old < 0) & (e_new >= 0)
+            if crossed.any():
+                # locate the event inside the step by Newton iteration on the step length
+                c = np.flatnonzero(crossed)
+                tau = hi[c]*e_old[c]/(e_old[c] - e_new[c])
+                nfev += 30*c.size
+                mc = None if mi is None else mi[:, c]
+                for _ in range(4):
+                    r_tau, _, f_tau = _dp_step(ri[:, c], ki[c], tau, fi[:, c], env, mc)
+                    de = f_tau[event]
+                    de = np.where(de == 0, 1, de)
+                    tau = np.clip(tau - (r_tau[event] - target[idx[c]])/de, 0, hi[c])
+                r_tau, _, f_tau = _dp_step(ri[:, c], ki[c], tau, fi[:, c], env, mc)
+                r_new[:, c] = r_tau
+                hi[c] = tau
+                hit[idx[c]] = True
+                active[idx[c]] = False
+
+        acc = idx[ok]
+        r[:, acc] = r_new[:, ok]
+        f[:, acc] = f_new[:, ok]
+        t[acc] = np.where(hi[ok] == left[ok], t_end[acc], t[acc] + hi[ok])
+        active[acc[t[acc] >= t_end[acc]]] = False
+    if _listeners:
+        _emit({"kind": "batch", "bodies": n, "time": time.perf_counter() - start, "nfev": int(nfev),
+               "steps": int(steps), "rejected": int(rejected)})
+    return t, r, hit
+
+
+def _store(values, out):
+    """Return the list of arrays values, or write them into the rows of out and return out."""
+    if out is None:
+        return values
+    for row, value in zip(out, values):
+        row[...] = value
+    return out
+
+
+class TrBatch:
+    """Compute properties of the ballistic trajectories of many free bodies at once. SI-units are assumed.
+    Every property is given as a NumPy array with one value per body, or as a scalar shared by all bodies."""
+
+    def __init__(self, init_pos=(0, 0), init_vel=(0, 0), mass=None, area=None, c=None, env=None):
+        """Initialize the bodies with properties at time t=0. init_pos and init_vel have shape (n, 2) or (2,).
+        Set env to an Environment shared by all bodies, by default the module's g and p apply without wind."""
+        self.init_pos = init_pos
+        self.init_vel = init_vel
+        self.area = area
+        self.mass = mass
+        self.c = c
+        self.env = env
+        self.rtol = 1e-6
+        self.atol = 1e-9
+
+    def __state(self):
+        return _unpack_state(self.init_pos, self.init_vel, 2)
+
+    def __len__(self):
+        """Return the number of bodies."""
+        return len(TrBatch.__state(self)[0])
+
+    def __drag(self, n):
+        """Return the drag factors k = 0.5*p*c*area/mass, without p if the bodies have an Environment."""
+        k = _drag_factor(self.c, self.area, self.mass)
+        return np.broadcast_to(k if self.env is not None else p*k, n)
+
+    def __gravity(self):
+        return g if self.env is None else self.env.g
+
+    def __integrate(self, t_end, event=None, target=0, direction=0):
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        k = TrBatch.__drag(self, x0.shape)
+        r0 = np.array([v0x, x0, v0y, y0])
+        return _integrate_batch(r0, k, t_end, event, target, direction, self.rtol, self.atol, env=self.env)
+
+    def pos(self, t, air=False, out=None):
+        """Return positions of the bodies at time t as a list of arrays [x, y]. t is a scalar or one time per body.
+        Set air=True to apply air resistance. Set out to an array of shape (2, n) to write [x, y] into it and return
+        it instead; without air resistance no temporary arrays are allocated."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        if air:
+            t, r, hit = TrBatch.__integrate(self, np.broadcast_to(t, x0.shape))
+            return _store([r[1], r[3]], out)
+        if out is None:
+            return [v0x*t + x0, -g*t**2/2 + v0y*t + y0]
+        np.multiply(v0x, t, out=out[0])
+        out[0] += x0
+        np.multiply(t, -g/2, out=out[1])  # y = (v0y - g*t/2)*t + y0
+        out[1] += v0y
+        out[1] *= t
+        out[1] += y0
+        return out
+
+    def v(self, t, air=False, out=None):
+        """Return velocities of the bodies at time t as a list of arrays [vx, vy]. t is a scalar or one time per body.
+        Set air=True to apply air resistance. Set out to an array of shape (2, n) to write [vx, vy] into it and return
+        it instead; without air resistance no temporary arrays are allocated."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        if air:
+            t, r, hit = TrBatch.__integrate(self, np.broadcast_to(t, x0.shape))
+            return _store([r[0], r[2]], out)
+        if out is None:
+            return [v0x + 0*t, -g*t + v0y]
+        out[0] = v0x
+        np.multiply(t, -g, out=out[1])
+        out[1] += v0y
+        return out
+
+    def speed(self, t, air=False):
+        """Return speeds of the bodies at time t as an array. Set air=True to apply air resistance."""
+        v = TrBatch.v(self, t, air)
+        return np.sqrt(v[0]**2 + v[1]**2)
+
+    def set_vel_trig(self, speed, angle):
+        """Change the initial velocities of the bodies by providing speeds and angles (in °). Return None."""
+        a = np.asarray(angle, dtype=float)*math.pi/180
+        speed = np.asarray(speed, dtype=float)
+        self.init_vel = np.stack(np.broadcast_arrays(speed*np.cos(a), speed*np.sin(a)), axis=-1)
+        return None
+
+    def max_alt(self, air=False, out=None):
+        """Return positions and times of the bodies at their highest altitudes as a list of arrays [x, y, t].
+        Set air=True to apply air resistance. The values are nan for bodies where no solution is found.
+        Set out to an array of shape (3, n) to write [x, y, t] into it and return it instead; without air resistance no
+        temporary arrays are allocated."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        if not air:
+            o = np.empty((3, len(x0))) if out is None else out
+            np.maximum(v0y, 0, out=o[2])
+            o[2] /= g
+            np.multiply(v0x, o[2], out=o[0])
+            o[0] += x0
+            np.multiply(o[2], -g/2, out=o[1])  # y = (v0y - g*t/2)*t + y0
+            o[1] += v0y
+            o[1] *= o[2]
+            o[1] += y0
+            return list(o) if out is None else out
+        t_max = np.maximum(v0y, 0)/g
+        t, r, hit = TrBatch.__integrate(self, t_max*10, 2, 0, -1)
+        dropped = v0y <= 0
+        x = np.where(dropped, x0, np.where(hit, r[1], np.nan))
+        y = np.where(dropped, y0, np.where(hit, r[3], np.nan))
+        t = np.where(dropped, 0, np.where(hit, t, np.nan))
+        return _store([x, y, t], out)
+
+    def landing_point(self, air=False, out=None):
+        """Return landing points and moments of impact of the bodies as a list of arrays [x, y, t].
+        Set air=True to apply air resistance. The values are nan for bodies that never land.
+        Set out to an array of shape (3, n) to write [x, y, t] into it and return it instead; without air resistance no
+        temporary arrays are allocated."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        if not air:
+            o = np.empty((3, len(x0))) if out is None else out
+            with np.errstate(invalid="ignore"):  # t = v0y/g + ((v0y/g)**2 + 2*y0/g)**0.5, only biggest solution
+                np.divide(v0y, g, out=o[2])
+                np.multiply(o[2], o[2], out=o[0])
+                np.multiply(y0, 2/g, out=o[1])
+                o[0] += o[1]
+                np.sqrt(o[0], out=o[0])
+                o[2] += o[0]
+                np.multiply(v0x, o[2], out=o[0])
+                o[0] += x0
+                np.multiply(o[0], 0, out=o[1])  # nan for bodies that never land
+            return list(o) if out is None else out
+        with np.errstate(invalid="ignore"):
+            t_imp_no_air = v0y/g + np.sqrt((v0y/g)**2 + 2*y0/g)  # only biggest solution
+        t, r, hit = TrBatch.__integrate(self, t_imp_no_air*10, 3, 0, -1)
+        start = t_imp_no_air == 0
+        x = np.where(start, x0, np.where(hit, r[1], np.nan))
+        y = np.where(start | hit, 0, np.nan)
+        t = np.where(start, 0, np.where(hit, t, np.nan))
+        return _store([x, y, t], out)
+
+    def time_x(self, x, air=False):
+        """Return times for the bodies to reach a distance x as an array. x is a scalar or one distance per body.
+        Set air=True to apply air resistance. The values are nan for bodies where no solution is found."""
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        x = np.broadcast_to(np.asarray(x, dtype=float), x0.shape)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(v0x != 0, (x - x0)/v0x, 0)
+        t = np.where(t < 0, np.nan, t)
+        if air:
+            t_air, r, hit = TrBatch.__integrate(self, t*10, 1, x)
+            t = np.where(t > 0, np.where(hit, t_air, np.nan), t)
+        return t
+
+    def tot_time(self, air=False):
+        """Return total times of flight of the bodies as an array. Set air=True to apply air resistance."""
+        return TrBatch.landing_point(self, air)[2]
+
+    def states(self, t, air=False):
+        """Return the states of the bodies at times t, an array with one row of increasing times per body, as a list of
+        arrays [t, x, y, vx, vy] of the same shape. Set air=True to apply air resistance, in which case all bodies are
+        integrated in lock-step from one column of times to the next."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = (q[:, None] for q in TrBatch.__state(self))
+        t = np.asarray(t, dtype=float)
+        if not air:
+            return [t, v0x*t + x0, -g*t**2/2 + v0y*t + y0, v0x + 0*t, -g*t + v0y]
+        k = TrBatch.__drag(self, len(x0))
+        r = np.array([v0x[:, 0], x0[:, 0], v0y[:, 0], y0[:, 0]])
+        out = np.empty((4,) + t.shape)
+        t_prev = np.zeros(len(x0))
+        for j in range(t.shape[1]):
+            r = _integrate_batch(r, k, t[:, j] - t_prev, rtol=self.rtol, atol=self.atol, env=self.env)[1]
+            out[:, :, j] = r
+            t_prev = t[:, j]
+        return [t, out[1], out[3], out[0], out[2]]
+
+    def sample(self, t_end, n=100, air=False):
+        """Return n evenly spaced samples of the states of the bodies from time t=0 to t_end (a scalar or one time per
+        body) as a list of arrays [t, x, y, vx, vy] with one row per body. Set air=True to apply air resistance."""
+        t_end = np.broadcast_to(np.asarray(t_end, dtype=float), len(self))
+        return TrBatch.states(self, t_end[:, None]*np.linspace(0, 1, n), air)
+
+    def __ranges(self, angle, i, back=None):
+        """Return the distances travelled with air resistance by the bodies with indices i when launched at their
+        speeds at angles in degrees, 0 for bodies that never land. Bodies where back is True are launched at 180°
+        minus the angle instead, and their distances are measured towards -x."""
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        n = len(x0)
+        speed = np.hypot(v0x[i], v0y[i])
+        back = np.zeros(n, dtype=bool) if back is None else back[i]
+        a = np.where(back, 180 - angle, angle)*math.pi/180
+        mass, area, c = (np.broadcast_to(np.asarray(q, dtype=float), n)[i] for q in (self.mass, self.area, self.c))
+        bodies = TrBatch(np.stack([x0[i], y0[i]], -1), np.stack([speed*np.cos(a), speed*np.sin(a)], -1), mass, area, c,
+                         self.env)
+        bodies.rtol = self.rtol
+        bodies.atol = self.atol
+        x = bodies.landing_point(True)[0]
+        return np.where(np.isnan(x), 0, np.where(back, x0[i] - x, x - x0[i]))
+
+    def __find_max(self, a, b, tol, stop, back=None):
+        """Golden-section search of the launch angle in [a, b] with the longest range for every body, see _find_max
+        and __ranges for back. Every iteration integrates one new angle for the bodies that have not converged."""
+        r = (math.sqrt(5) - 1)/2
+        i = np.arange(len(a))
+        c = b - r*(b - a)
+        d = a + r*(b - a)
+        fc = TrBatch.__ranges(self, c, i, back)
+        fd = TrBatch.__ranges(self, d, i, back)
+        active = (b - a > tol) & (np.maximum(fc, fd) < stop)
+        while active.any():
+            j = np.flatnonzero(active)
+            left = fc[j] > fd[j]  # maximum in [a, d]
+            cj, dj, fcj, fdj = c[j], d[j], fc[j], fd[j]
+            b[j] = np.where(left, dj, b[j])
+            a[j] = np.where(left, a[j], cj)
+            new = np.where(left, b[j] - r*(b[j] - a[j]), a[j] + r*(b[j] - a[j]))
+            f = TrBatch.__ranges(self, new, j, back)
+            c[j] = np.where(left, new, dj)
+            fc[j] = np.where(left, f, fdj)
+            d[j] = np.where(left, cj, new)
+            fd[j] = np.where(left, fcj, f)
+            active[j] = (b[j] - a[j] > tol) & (np.maximum(fc[j], fd[j]) < stop[j])
+        return np.where(fc >= fd, c, d), np.maximum(fc, fd)
+
+    def optimal_angle(self, air=False, tol=0.01):
+        """Return the launch angles in degrees that give the bodies the longest range towards +x at their initial
+        speeds, and the x-coordinates of the landing points, as a list of arrays [a, x]. Set air=True to apply air
+        resistance, the angles are then found to within tol degrees by golden-section search of all bodies at once.
+        The values are nan for bodies that never land."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        speed = np.hypot(v0x, v0y)
+        with np.errstate(invalid="ignore"):
+            root = np.sqrt(speed**2 + 2*g*y0)  # nan for bodies that never land
+        if not air:
+            a = np.arctan2(speed, root)
+            t = (speed*np.sin(a) + root)/g
+            return [a*180/math.pi, x0 + speed*np.cos(a)*t]
+        TrBatch.__drag(self, x0.shape)
+        a, d = TrBatch.__find_max(self, np.where(y0 > 0, -90.0, 0.0), np.full(len(x0), 90.0), tol,
+                                  np.full(len(x0), np.inf))
+        return [np.where(np.isnan(root), np.nan, a), np.where(np.isnan(root), np.nan, x0 + d)]
+
+    def angles_for_range(self, x, air=False, tol=0.001):
+        """Return the low and high launch angles in degrees at which the bodies with their initial speeds land at a
+        distance x as a list of arrays [a_low, a_high]. x is a scalar or one distance per body. Set air=True to apply
+        air resistance, then all bodies are solved at once. Set a lower tolerance tol to get a more precise answer.
+        The values are nan for bodies where x is out of reach."""
+        g = TrBatch.__gravity(self)
+        x0, y0, v0x, v0y = TrBatch.__state(self)
+        speed = np.hypot(v0x, v0y)
+        x = np.broadcast_to(np.asarray(x, dtype=float), x0.shape)
+        d = np.abs(x - x0)
+        if not air:
+            with np.errstate(invalid="ignore"):
+                root = np.sqrt(speed**4 - g*(g*d**2 - 2*y0*speed**2))  # nan if out of reach
+            a = [np.arctan2(speed**2 - root, g*d)*180/math.pi, np.arctan2(speed**2 + root, g*d)*180/math.pi]
+        else:
+            TrBatch.__drag(self, x0.shape)
+            n = len(x0)
+            lo = np.where(y0 > 0, -90.0, 0.0)
+            back = x < x0  # searched directly, wind breaks the symmetry of targets behind the bodies
+            c, fc = TrBatch.__find_max(self, lo.copy(), np.full(n, 90.0), 1e-6, d, back)
+            reach = d - fc <= tol*d
+            a = [np.where(reach, c, np.nan), np.where(reach, c, np.nan)]
+            k = np.flatnonzero(reach & (fc > d))  # both solutions are bracketed by the maximum
+            i = np.concatenate([k, k])
+            lo_hi = np.concatenate([lo[k], c[k]])
+            hi_lo = np.concatenate([c[k], np.full(len(k), 90.0)])
+            root = TrBatch.__find_angles(self, lo_hi, hi_lo, i, d[i], tol, back)
+            a[0][k] = root[:len(k)]
+            a[1][k] = root[len(k):]
+        flip = x < x0
+        return [np.where(flip, 180 - a[0], a[0]), np.where(flip, 180 - a[1], a[1])]
+
+    def __find_angles(self, a, b, i, d, tol, back):
+        """Return the angles in [a, b] at which the bodies with indices i travel a distance d, by the Illinois variant
+        of regula falsi for all bodies at once, see _find_root and __ranges for back."""
+        fa = TrBatch.__ranges(self, a, i, back) - d
+        fb = TrBatch.__ranges(self, b, i, back) - d
+        c = np.where(np.abs(fa) <= tol*d, a, b)
+        active = (np.abs(fa) > tol*d) & (np.abs(fb) > tol*d)
+        for _ in range(100):
+            if not active.any():
+                return c
+            j = np.flatnonzero(active)
+            c[j] = b[j] - fb[j]*(b[j] - a[j])/(fb[j] - fa[j])
+            fc = TrBatch.__ranges(self, c[j], i[j], back) - d[j]
+            swap = fc*fb[j] < 0
+            a[j] = np.where(swap, b[j], a[j])
+            fa[j] = np.where(swap, fb[j], fa[j]/2)
+            b[j] = c[j]
+            fb[j] = fc
+            active[j] = np.abs(fc) > tol*d[j]
+        c[active] = np.nan
+        return c
+
+
+class Tr3D:
+    """Compute properties of the ballistic trajectories of spinning bodies in three dimensions, where y is the altitude
+    and x and z span the ground. SI-units are assumed. As in TrBatch, every property is given as a NumPy array with one
+    value (or one vector) per body, or as a scalar shared by all bodies, and all bodies are integrated at once by the
+    lock-step integrator of TrBatch."""
+
+    def __init__(self, init_pos=(0, 0, 0), init_vel=(0, 0, 0), mass=None, area=None, c=None, spin=None, radius=None,
+                 cl=1.0, env=None):
+        """Initialize the bodies with properties at time t=0. init_pos, init_vel and the angular velocity spin in rad/s
+        have shape (n, 3) or (3,). A spinning body with the given radius feels the Magnus force
+        0.5*density*area*radius*cl*(spin × u) for its velocity u relative to the air, so cl is the lift coefficient
+        divided by the spin ratio radius*|spin|/|u|. Set env to an Environment shared by all bodies, whose wind may
+        include a crosswind wz, by default the module's g and p apply without wind."""
+        self.init_pos = init_pos
+        self.init_vel = init_vel
+        self.area = area
+        self.mass = mass
+        self.c = c
+        self.spin = spin
+        self.radius = radius
+        self.cl = cl
+        self.env = env
+        self.rtol = 1e-6
+        self.atol = 1e-9
+
+    def __state(self):
+        return _unpack_state(self.init_pos, self.init_vel, 3)
+
+    def __len__(self):
+        """Return the number of bodies."""
+        return len(Tr3D.__state(self)[0])
+
+    def __drag(self, n):
+        """Return the drag factors k = 0.5*c*area/mass, the air density is applied by _drag_rhs_3d."""
+        return np.broadcast_to(_drag_factor(self.c, self.area, self.mass), n)
+
+    def __magnus(self, n):
+        """Return the spin vectors scaled by 0.5*area*radius*cl/mass as rows [mx, my, mz], or None without spin."""
+        if self.spin is None or not np.any(self.spin):
+            return None
+        if self.radius is None:
+            raise RuntimeError("The radius has to be provided to apply the Magnus force")
+        f = 0.5*np.asarray(self.area, dtype=float)*np.asarray(self.radius, dtype=float)*np.asarray(self.cl, dtype=float)
+        f = np.broadcast_to(f/np.asarray(self.mass, dtype=float), n)
+        return f*np.broadcast_to(np.asarray(self.spin, dtype=float), (n, 3)).T
+
+    def __gravity(self):
+        return g if self.env is None else self.env.g
+
+    def __integrate(self, t_end, event=None, target=0, direction=0, r0=None):
+        x0, y0, z0, v0x, v0y, v0z = Tr3D.__state(self)
+        if r0 is None:
+            r0 = np.array([v0x, x0, v0y, y0, v0z, z0])
+        k = Tr3D.__drag(self, len(x0))
+        return _integrate_batch(r0, k, t_end, event, target, direction, self.rtol, self.atol, env=self.env,
+                                magnus=Tr3D.__magnus(self, len(x0)))
+
+    def pos(self, t, air=False):
+        """Return positions of the bodies at time t as a list of arrays [x, y, z]. t is a scalar or one time per body.
+        Set air=True to apply air resistance and the Magnus force."""
+        g = Tr3D.__gravity(self)
+        x0, y0, z0, v0x, v0y, v0z = Tr3D.__state(self)
+        if air:
+            t, r, hit = Tr3D.__integrate(self, np.broadcast_to(t, x0.shape))
+            return [r[1], r[3], r[5]]
+        return [v0x*t + x0, -g*t**2/2 + v0y*t + y0, v0z*t + z0]
+
+    def v(self, t, air=False):
+        """Return velocities of the bodies at time t as a list of arrays [vx, vy, vz]. t is a scalar or one time per
+        body. Set air=True to apply air resistance and the Magnus force."""
+        g = Tr3D.__gravity(self)
+        x0, y0, z0, v0x, v0y, v0z = Tr3D.__state(self)
+        if air:
+            t, r, hit = Tr3D.__integrate(self, np.broadcast_to(t, x0.shape))
+            return [r[0], r[2], r[4]]
+        return [v0x + 0*t, -g*t + v0y, v0z + 0*t]
+
+    def speed(self, t, air=False):
+        """Return speeds of the bodies at time t as an array. Set air=True to apply air resistance."""
+        v = Tr3D.v(self, t, air)
+        return np.sqrt(v[0]**2 + v[1]**2 + v[2]**2)
+
+    def set_vel_trig(self, speed, angle, azimuth=0):
+        """Change the initial velocities of the bodies by providing speeds, elevation angles (in °) and azimuths (in °,
+        from the x-axis towards the z-axis). Return None."""
+        a = np.asarray(angle, dtype=float)*math.pi/180
+        b = np.asarray(azimuth, dtype=float)*math.pi/180
+        speed = np.asarray(speed, dtype=float)
+        self.init_vel = np.stack(np.broadcast_arrays(speed*np.cos(a)*np.cos(b), speed*np.sin(a),
+                                                     speed*np.cos(a)*np.sin(b)), axis=-1)
+        return None
+
+    def max_alt(self, air=False):
+        """Return positions and times of the bodies at their highest altitudes as a list of arrays [x, y, z, t].
+        Set air=True to apply air resistance and the Magnus force. The values are nan for bodies where no solution is
+        found."""
+        g = Tr3D.__gravity(self)
+        x0, y0, z0, v0x, v0y, v0z = Tr3D.__state(self)
+        t_max = np.maximum(v0y, 0)/g
+        if not air:
+            return Tr3D.pos(self, t_max) + [t_max]
+        t, r, hit = Tr3D.__integrate(self, t_max*10, 2, 0, -1)
+        dropped = v0y <= 0
+        return [np.where(dropped, q0, np.where(hit, q, np.nan)) for q0, q in ((x0, r[1]), (y0, r[3]), (z0, r[5]),
+                                                                              (0, t))]
+
+    def landing_point(self, air=False):
+        """Return landing points and moments of impact of the bodies as a list of arrays [x, y, z, t].
+        Set air=True to apply air resistance and the Magnus force. The values are nan for bodies that never land."""
+        g = Tr3D.__gravity(self)
+        x0, y0, z0, v0x, v0y, v0z = Tr3D.__state(self)
+        with np.errstate(invalid="ignore"):
+            t_imp_no_air = v0y/g + np.sqrt((v0y/g)**2 + 2*y0/g)  # only biggest solution
+        if not air:
+            x, y, z = Tr3D.pos(self, t_imp_no_air)
+            return [x, 0*t_imp_no_air, z, t_imp_no_air]
+        t, r, hit = Tr3D.__integrate(self, t_imp_no_air*10, 3, 0, -1)
+        start = t_imp_no_air == 0
+        return [np.where(start, x0, np.where(hit, r[1], np.nan)), np.where(start | hit, 0, np.nan),
+                np.where(start, z0, np.where(hit, r[5], np.nan)), np.where(start, 0, np.where(hit, t, np.nan))]
+
+    def tot_time(self, air=False):
+        """Return total times of flight of the bodies as an array. Set air=True to apply air resistance."""
+        return Tr3D.landing_point(self, air)[3]
+
+    def states(self, t, air=False):
+        """Return the states of the bodies at times t, an array with one row of increasing times per body, as a list of
+        arrays [t, x, y, z, vx, vy, vz] of the same shape. Set air=True to apply air resistance and the Magnus force."""
+        g = Tr3D.__gravity(self)
+        x0, y0, z0, v0x, v0y, v0z = (q[:, None] for q in Tr3D.__state(self))
+        t = np.asarray(t, dtype=float)
+        if not air:
+            return [t, v0x*t + x0, -g*t**2/2 + v0y*t + y0, v0z*t + z0, v0x + 0*t, -g*t + v0y, v0z + 0*t]
+        r = np.array([v0x[:, 0], x0[:, 0], v0y[:, 0], y0[:, 0], v0z[:, 0], z0[:, 0]])
+        out = np.empty((6,) + t.shape)
+        t_prev = np.zeros(len(x0))
+        for j in range(t.shape[1]):
+            r = Tr3D.__integrate(self, t[:, j] - t_prev, r0=r)[1]
+            out[:, :, j] = r
+            t_prev = t[:, j]
+        return [t, out[1], out[3], out[5], out[0], out[2], out[4]]
+
+    def sample(self, t_end, n=100, air=False):
+        """Return n evenly spaced samples of the states of the bodies from time t=0 to t_end (a scalar or one time per
+        body) as a list of arrays [t, x, y, z, vx, vy, vz] with one row per body. Set air=True to apply air
+        resistance and the Magnus force."""
+        t_end = np.broadcast_to(np.asarray(t_end, dtype=float), len(self))
+        return Tr3D.states(self, t_end[:, None]*np.linspace(0, 1, n), air)
+
+    def add_plot(self, t, air=False, c="red", res=100, ax=None):
+        """Add a plot of the trajectories of the bodies from time t=0 to t (a scalar or one time per body) with the
+        altitude y upwards. Set air=True to apply air resistance and the Magnus force. Set line color with argument c
+        as a string. Set a higher resolution res to get a more precise result. Set ax to a matplotlib Axes with
+        projection="3d" to draw on it, by default 3D axes are added to pyplot's current figure unless its first axes
+        are 3D. Call show_plot() to show the plot. Return None."""
+        s = Tr3D.sample(self, t, res + 1, air)
+        if ax is None:
+            fig = _pyplot().gcf()
+            ax = fig.axes[0] if fig.axes and fig.axes[0].name == "3d" else fig.add_subplot(projection="3d")
+        for x, y, z in zip(s[1], s[2], s[3]):
+            ax.plot(x, z, y, linewidth=1, color=c)
+        ax.set_title("Trajectory from t=0 to t")
+        ax.set_xlabel("x")
+        ax.set_ylabel("z")
+        ax.set_zlabel("y")
         return None
 
     def show_plot(self):
         """Show plots added with add_plot. Return None."""
-        plt.show()
-        return None
\ No newline at end of file
+        _pyplot().show()
+        return None
+
+
+def _drag_rhs_into(r, k, out, env=None):
+    """Write the time derivative of the states r = [vx, x, vy, y], one column per body, into out without allocating
+    memory unless env has wind or a density table. k = 0.5*c*area/mass, the air density is p or that of env."""
+    gravity = g if env is None else env.g
+    s = out[1]  # scratch, holds vx in the end
+    if env is None or not any(env.wind[:2]):
+        ux, uy = r[0], r[2]
+    else:
+        ux, uy = r[0] - env.wind[0], r[2] - env.wind[1]
+    np.hypot(ux, uy, out=s)
+    s *= k
+    if env is None:
+        s *= p
+    elif env.dy is None:
+        s *= env.density
+    else:
+        s *= env.density_at(r[3])
+    np.multiply(s, ux, out=out[0])
+    np.negative(out[0], out=out[0])
+    np.multiply(s, uy, out=out[2])
+    np.negative(out[2], out=out[2])
+    out[2] -= gravity
+    out[1] = r[0]
+    out[3] = r[2]
+    return out
+
+
+def _hermite_root(y0, m0, y1, m1, iterations=3):
+    """Return theta in [0, 1] where the cubic Hermite interpolant through y0, y1 with slopes m0, m1 (per unit theta)
+    is 0, by Newton iteration from the linear interpolation."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        theta = np.clip(np.nan_to_num(y0/(y0 - y1)), 0, 1)
+        for _ in range(iterations):
+            h = _hermite(theta, y0, m0, y1, m1)
+            d = (6*theta**2 - 6*theta)*(y0 - y1) + (3*theta**2 - 4*theta + 1)*m0 + (3*theta**2 - 2*theta)*m1
+            theta = np.clip(theta - np.where(d != 0, h/d, 0), 0, 1)
+    return theta
+
+
+def _hermite(theta, y0, m0, y1, m1):
+    return ((2*theta - 3)*theta**2 + 1)*y0 + ((theta - 2)*theta + 1)*theta*m0 + (3 - 2*theta)*theta**2*y1 + \
+        (theta - 1)*theta**2*m1
+
+
+class Population:
+    """Advance a population of bodies in steps of a fixed size, e.g. once per frame of a game loop. The states of all
+    bodies are kept in one array that every step updates in place, and bodies that reach the ground (y=0) are removed.
+    A step costs the same number of right-hand side evaluations for every body: 4 with method="rk4" (classic
+    Runge-Kutta, error of order dt**4) and 1 with method="semi-implicit" (symplectic Euler, error of order dt, but
+    cheaper and stable for long runs). SI-units are assumed."""
+
+    def __init__(self, capacity=1024, method="rk4", env=None):
+        """Initialize an empty population with room for capacity bodies, more are allocated as bodies are added. Set
+        env to an Environment shared by all bodies, by default the module's g and p apply without wind."""
+        if method not in ("rk4", "semi-implicit"):
+            raise ValueError("Unknown fixed-step method: " + str(method))
+        self.method = method
+        self.env = env
+        self.nfev = 0  # right-hand side evaluations, counted per body
+        self.substeps = 0  # steps taken by the last call of step
+        self.__n = 0
+        self.__next_id = 0
+        Population.__allocate(self, capacity)
+
+    def __allocate(self, capacity):
+        n = self.__n
+        r = np.empty((4, capacity))
+        k = np.empty(capacity)
+        t = np.empty(capacity)
+        ids = np.empty(capacity, dtype=np.int64)
+        if n:
+            r[:, :n] = self.__r[:, :n]
+            k[:n] = self.__k[:n]
+            t[:n] = self.__t[:n]
+            ids[:n] = self.__ids[:n]
+        self.__r, self.__k, self.__t, self.__ids = r, k, t, ids
+        self.__work = np.empty((5, 4, capacity))  # stages of the step and the state before it
+
+    def __len__(self):
+        return self.__n
+
+    def add(self, init_pos, init_vel, mass, area, c):
+        """Add bodies at positions init_pos with velocities init_vel, arrays of shape (n, 2) or (2,), and mass,
+        reference area and drag coefficient, each a scalar or one value per body. Return the ids given to the new
+        bodies as an array."""
+        x0, y0, v0x, v0y, k = np.broadcast_arrays(*_unpack_state(init_pos, init_vel, 2), _drag_factor(c, area, mass))
+        m = len(x0)
+        n = self.__n
+        if n + m > len(self.__k):
+            Population.__allocate(self, max(2*len(self.__k), n + m))
+        self.__r[:, n:n + m] = [v0x, x0, v0y, y0]
+        self.__k[n:n + m] = k
+        self.__t[n:n + m] = 0
+        self.__ids[n:n + m] = np.arange(self.__next_id, self.__next_id + m)
+        self.__n = n + m
+        self.__next_id += m
+        return self.__ids[n:n + m].copy()
+
+    def ids(self):
+        """Return the ids of the bodies in flight as an array, in the order of pos, v and age."""
+        return self.__ids[:self.__n].copy()
+
+    def pos(self):
+        """Return positions of the bodies in flight as a list of arrays [x, y]."""
+        return [self.__r[1, :self.__n].copy(), self.__r[3, :self.__n].copy()]
+
+    def v(self):
+        """Return velocities of the bodies in flight as a list of arrays [vx, vy]."""
+        return [self.__r[0, :self.__n].copy(), self.__r[2, :self.__n].copy()]
+
+    def age(self):
+        """Return the times since the bodies in flight were added as an array."""
+        return self.__t[:self.__n].copy()
+
+    def step(self, dt, h=None, budget=None):
+        """Advance all bodies by time dt, in substeps of at most h (one step of dt if h is None). Set budget to the most
+        right-hand side evaluations to spend, the substeps are then made longer (and the result less accurate) as
+        needed to keep within it, but at least one step is taken. Bodies that reach the ground are removed. Return
+        their ids, landing points and moments of impact (since they were added) as a list of arrays [ids, x, t]."""
+        stages = 4 if self.method == "rk4" else 1
+        n = self.__n
+        m = 1 if h is None else max(1, math.ceil(dt/h - 1e-9))
+        if budget is not None and n > 0:
+            m = max(1, min(m, budget//(stages*n)))
+        self.substeps = m
+        nfev = self.nfev
+        start = time.perf_counter()
+        impacts = [[], [], []]
+        for _ in range(m):
+            for q, a in zip(impacts, Population.__step(self, dt/m)):
+                q.append(a)
+        if _listeners:  # bodies removed in a substep are not counted in the next ones
+            _emit({"kind": "batch", "bodies": n, "time": time.perf_counter() - start, "nfev": self.nfev - nfev,
+                   "steps": (self.nfev - nfev)//stages, "rejected": 0})
+        return [np.concatenate(q) for q in impacts]
+
+    def __step(self, h):
+        n = self.__n
+        r = self.__r[:, :n]
+        k = self.__k[:n]
+        f1, f2, f3, f4, r_old = (w[:, :n] for w in self.__work)
+        r_old[...] = r
+        _drag_rhs_into(r, k, f1, self.env)
+        if self.method == "rk4":
+            np.multiply(f1, h/2, out=f4)
+            f4 += r
+            _drag_rhs_into(f4, k, f2, self.env)
+            np.multiply(f2, h/2, out=f4)
+            f4 += r
+            _drag_rhs_into(f4, k, f3, self.env)
+            np.multiply(f3, h, out=f4)
+            f4 += r
+            f2 += f3
+            f2 *= 2
+            f2 += f1
+            _drag_rhs_into(f4, k, f3, self.env)
+            f2 += f3
+            f2 *= h/6
+            r += f2
+            self.nfev += 4*n
+        else:  # velocities first, then positions with the new velocities
+            r[0] += h*f1[0]
+            r[2] += h*f1[2]
+            r[1] += h*r[0]
+            r[3] += h*r[2]
+            self.nfev += n
+        self.__t[:n] += h
+
+        hit = np.flatnonzero(r[3] < 0)
+        if hit.size == 0:
+            return [self.__ids[:0].copy(), np.empty(0), np.empty(0)]
+        # locate the impact inside the step on the cubic Hermite interpolant of the positions and velocities
+        a, b = r_old[:, hit], r[:, hit]
+        theta = _hermite_root(a[3], h*a[2], b[3], h*b[2])
+        x = _hermite(theta, a[1], h*a[0], b[1], h*b[0])
+        t = self.__t[hit] - (1 - theta)*h
+        ids = self.__ids[hit].copy()
+        keep = np.flatnonzero(r[3] >= 0)
+        m = len(keep)
+        self.__r[:, :m] = r[:, keep]
+        self.__k[:m] = k[keep]
+        self.__t[:m] = self.__t[keep]
+        self.__ids[:m] = self.__ids[keep]
+        self.__n = m
+        return [ids, x, t]
+
+    def error(self, dt, h=None, n=100):
+        """Return the largest errors of the landing points and moments of impact of up to n bodies in flight, when
+        advanced with steps as in step(dt, h) until they land, compared with the adaptive integrator of TrBatch at tight
+        tolerances, as a list [x_err, t_err]. The population is not changed."""
+        m = min(n, self.__n)
+        if m == 0:
+            return [0.0, 0.0]
+        r = self.__r[:, :m]
+        k = self.__k[:m]
+        copy = Population(m, self.method, self.env)
+        copy.add(np.stack([r[1], r[3]], -1), np.stack([r[0], r[2]], -1), 1, 2*k, 1)
+        x = np.full(m, np.nan)
+        t = np.full(m, np.nan)
+        for _ in range(10**6):
+            if not len(copy):
+                break
+            i, xi, ti = copy.step(dt, h)
+            x[i] = xi
+            t[i] = ti
+        reference = TrBatch(np.stack([r[1], r[3]], -1), np.stack([r[0], r[2]], -1), 1, 2*k, 1, self.env)
+        reference.rtol = 1e-10
+        reference.atol = 1e-10
+        x_ref, y_ref, t_ref = reference.landing_point(True)
+        return [float(np.nanmax(np.abs(x - x_ref))), float(np.nanmax(np.abs(t - t_ref)))]
+
+
+def batch_landing_point(init_pos, init_vel, mass=None, area=None, c=None, air=False):
+    """Return landing points and moments of impact of many bodies as a list of arrays [x, y, t]. Arguments are NumPy
+    arrays with one value (or one vector) per body, or values shared by all bodies. Set air=True to apply air
+    resistance. The values are nan for bodies that never land."""
+    return TrBatch(init_pos, init_vel, mass, area, c).landing_point(air)
+
+
+# fields of the structured arrays returned by sweep()
+sweep_dtype = np.dtype([("speed", float), ("angle", float), ("mass", float), ("area", float), ("c", float),
+                        ("x", float), ("t", float), ("x_max", float), ("y_max", float), ("t_max", float)])
+
+
+def _sweep_chunk(grid, init_pos, env, rtol, atol, air, start, stop):
+    """Evaluate rows start to stop of the flattened parameter grid. Run in the worker processes of sweep()."""
+    i = np.unravel_index(np.arange(start, stop), tuple(len(a) for a in grid))
+    speed, angle, mass, area, c = (a[j] for a, j in zip(grid, i))
+    bodies = TrBatch(init_pos, None, mass, area, c, env)
+    bodies.rtol = rtol
+    bodies.atol = atol
+    bodies.set_vel_trig(speed, angle)
+    out = np.empty(stop - start, dtype=sweep_dtype)
+    out["speed"], out["angle"], out["mass"], out["area"], out["c"] = speed, angle, mass, area, c
+    out["x"], _, out["t"] = bodies.landing_point(air)
+    out["x_max"], out["y_max"], out["t_max"] = bodies.max_alt(air)
+    return out
+
+
+def _sweep_iter(grid, init_pos, env, rtol, atol, air, workers, chunk_size):
+    n = int(np.prod([len(a) for a in grid]))
+    starts = range(0, n, chunk_size)
+    stops = [min(start + chunk_size, n) for start in starts]
+    if workers == 1:
+        for start, stop in zip(starts, stops):
+            yield _sweep_chunk(grid, init_pos, env, rtol, atol, air, start, stop)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_sweep_chunk, repeat(grid), repeat(init_pos), repeat(env), repeat(rtol), repeat(atol),
+                                repeat(air), starts, stops)
+
+
+def sweep(speed, angle, mass=None, area=None, c=None, init_pos=(0, 0), air=False, workers=None, chunk_size=1000,
+          stream=False, env=None, rtol=1e-6, atol=1e-9):
+    """Compute landing point, moment of impact and highest altitude for every combination of the given initial
+    speeds, angles (in °), masses, reference areas and drag coefficients, each a scalar or a sequence. All bodies start
+    at init_pos in the Environment env (None for the module's g and p). Set air=True to apply air resistance, the
+    trajectories are then integrated with the tolerances rtol and atol.
+    The grid is split into chunks of chunk_size bodies that are evaluated on a pool of worker processes (workers=None
+    uses one per CPU, workers=1 evaluates in this process). Return a structured array of dtype sweep_dtype with one row
+    per combination, in the order of the grid with speed varying slowest. Set stream=True to instead get an iterator
+    over the chunks in that order. Results do not depend on workers or chunk_size."""
+    grid = tuple(np.atleast_1d(np.asarray(np.nan if a is None else a, dtype=float)).ravel()
+                 for a in (speed, angle, mass, area, c))
+    chunks = _sweep_iter(grid, init_pos, env, rtol, atol, air, workers, chunk_size)
+    if stream:
+        return chunks
+    return np.concatenate(list(chunks))
+
+
+class FiringTable:
+    """Precomputed table of landing points, times of flight and highest altitudes of a body with air resistance over a
+    grid of initial speeds and angles. Queries inside the grid are answered by bicubic spline interpolation together
+    with an estimate of the interpolation error, queries outside the grid by integrating the trajectory."""
+
+    _fields = ("x", "t", "x_max", "y_max", "t_max")
+
+    def __init__(self, body, speeds, angles, workers=1):
+        """Build the table for a body (a Tr object with area, mass and drag coefficient) launched from its initial
+        position in its environment. speeds and angles (in °) are increasing sequences of at least 7 values each. The
+        table is computed with sweep() at the tolerances rtol and atol of the body, using the given number of worker
+        processes. Queries outside the table integrate with the solver settings of the body."""
+        self.init_pos = list(body.init_pos)
+        self.mass = body.mass
+        self.area = body.area
+        self.c = body.c
+        self.env = body.env
+        self.method = body.method
+        self.rtol = body.rtol
+        self.atol = body.atol
+        self.analytic = body.analytic
+        self.speeds = np.asarray(speeds, dtype=float)
+        self.angles = np.asarray(angles, dtype=float)
+        result = sweep(self.speeds, self.angles, self.mass, self.area, self.c, self.init_pos, True, workers,
+                       env=self.env, rtol=self.rtol, atol=self.atol)
+        shape = (len(self.speeds), len(self.angles))
+        self.table = {k: result[k].reshape(shape) for k in FiringTable._fields}
+        FiringTable.__fit(self)
+
+    def __fit(self):
+        from scipy.interpolate import RectBivariateSpline
+        if len(self.speeds) < 7 or len(self.angles) < 7:
+            raise ValueError("A firing table needs at least 7 speeds and 7 angles.")
+        if any(np.isnan(v).any() for v in self.table.values()):
+            raise RuntimeError("No real solution was found for every body in the table. It seems like some never land.")
+        # the error is estimated by comparing with a table of every other speed and angle
+        i = np.unique(np.r_[np.arange(0, len(self.speeds), 2), len(self.speeds) - 1])
+        j = np.unique(np.r_[np.arange(0, len(self.angles), 2), len(self.angles) - 1])
+        self.__fine = {}
+        self.__coarse = {}
+        for k, v in self.table.items():
+            self.__fine[k] = RectBivariateSpline(self.speeds, self.angles, v)
+            self.__coarse[k] = RectBivariateSpline(self.speeds[i], self.angles[j], v[np.ix_(i, j)])
+
+    def __body(self, speed=0, angle=0):
+        """Return a new body with the properties of this table, so that queries from several threads do not share
+        one."""
+        body = Tr()
+        body.init_pos = list(self.init_pos)
+        body.mass = self.mass
+        body.area = self.area
+        body.c = self.c
+        body.env = self.env
+        body.method = self.method
+        body.rtol = self.rtol
+        body.atol = self.atol
+        body.analytic = self.analytic
+        body.set_vel_trig(speed, angle)
+        return body
+
+    def __tolerance(self, values):
+        """Return the estimated absolute errors of values integrated outside the table."""
+        return [self.rtol*abs(v) + self.atol for v in values]
+
+    def __inside(self, speed, angle):
+        return self.speeds[0] <= speed <= self.speeds[-1] and self.angles[0] <= angle <= self.angles[-1]
+
+    def __lookup(self, keys, speed, angle):
+        values = [float(self.__fine[k](speed, angle)[0, 0]) for k in keys]
+        errors = [abs(v - float(self.__coarse[k](speed, angle)[0, 0])) for k, v in zip(keys, values)]
+        return values, errors
+
+    def landing_point(self, speed, angle, full_output=False):
+        """Return landing point and moment of impact for initial speed and angle (in °) as a list [x, y, t].
+        Set full_output=True to get a list [[x, y, t], [x_err, y_err, t_err]] including estimated absolute errors,
+        which outside the table follow from the tolerances of the integration. Return None if no solution is found."""
+        if FiringTable.__inside(self, speed, angle):
+            (x, t), (x_err, t_err) = FiringTable.__lookup(self, ("x", "t"), speed, angle)
+        else:
+            p = FiringTable.__body(self, speed, angle).landing_point(True)
+            if p is None:
+                return None
+            x, t = p[0], p[2]
+            x_err, t_err = FiringTable.__tolerance(self, [x, t])
+        if full_output:
+            return [[x, 0, t], [x_err, 0, t_err]]
+        return [x, 0, t]
+
+    def max_alt(self, speed, angle, full_output=False):
+        """Return position and time at the highest altitude for initial speed and angle (in °) as a list [x, y, t].
+        Set full_output=True to also get estimated absolute errors as for landing_point. Return None if no solution is
+        found."""
+        if FiringTable.__inside(self, speed, angle):
+            p, err = FiringTable.__lookup(self, ("x_max", "y_max", "t_max"), speed, angle)
+        else:
+            p = FiringTable.__body(self, speed, angle).max_alt(True)
+            if p is None:
+                return None
+            err = FiringTable.__tolerance(self, p)
+        if full_output:
+            return [p, err]
+        return p
+
+    def tot_time(self, speed, angle):
+        """Return total time of flight for initial speed and angle (in °)."""
+        p = FiringTable.landing_point(self, speed, angle)
+        return p[2]
+
+    def i_vel(self, x, a, tol=0.001, full_output=False):
+        """Return necessary initial speed at angle a in degrees to land at a distance x as a scalar. Outside the table
+        the speed is found with Tr.i_vel and the tolerance tol. Set full_output=True to get a list [v, v_err] including
+        the estimated absolute error. RuntimeError is raised if no solution is found."""
+        from scipy.optimize import brentq
+        r = None
+        if self.angles[0] <= a <= self.angles[-1]:
+            r = self.__fine["x"](self.speeds, a)[:, 0]
+            i = np.flatnonzero((r[:-1] - x)*(r[1:] - x) <= 0)
+        if r is None or len(i) == 0:
+            v = FiringTable.__body(self).i_vel(x, a, True, tol)
+            v_err = tol*v
+        else:
+            i = i[0]
+            v = brentq(lambda s: self.__fine["x"](s, a)[0, 0] - x, self.speeds[i], self.speeds[i + 1])
+            x_err = FiringTable.__lookup(self, ("x",), v, a)[1][0]
+            v_err = x_err/abs(self.__fine["x"](v, a, dx=1)[0, 0])
+        if full_output:
+            return [v, v_err]
+        return v
+
+    def tot_time_for_range(self, x, a):
+        """Return total time of flight for a shot at angle a in degrees that lands at a distance x as a scalar.
+        RuntimeError is raised if no solution is found."""
+        v = FiringTable.i_vel(self, x, a)
+        p = FiringTable.landing_point(self, v, a)
+        if p is None:
+            raise RuntimeError("No real solution was found.")
+        return p[2]
+
+    def save(self, file):
+        """Save this table to a NumPy .npz file, given as a file name or file object. Return None."""
+        env = {}
+        if self.env is not None:
+            env = {"env_g": self.env.g, "env_density": self.env.density, "env_wind": self.env.wind,
+                   "env_dy": np.nan if self.env.dy is None else self.env.dy}
+        np.savez(file, init_pos=self.init_pos, mass=self.mass, area=self.area, c=self.c, method=self.method,
+                 rtol=self.rtol, atol=self.atol, analytic=self.analytic, speeds=self.speeds, angles=self.angles,
+                 **self.table, **env)
+        return None
+
+    @staticmethod
+    def load(file):
+        """Return a table saved with save()."""
+        table = FiringTable.__new__(FiringTable)
+        with np.load(file) as data:
+            table.init_pos = data["init_pos"].tolist()
+            table.mass = float(data["mass"])
+            table.area = float(data["area"])
+            table.c = float(data["c"])
+            # tables saved without solver settings were computed at the tolerances of TrBatch
+            table.method = str(data["method"]) if "method" in data else "RK45"
+            table.rtol = float(data["rtol"]) if "rtol" in data else 1e-6
+            table.atol = float(data["atol"]) if "atol" in data else 1e-9
+            table.analytic = bool(data["analytic"]) if "analytic" in data else True
+            table.speeds = data["speeds"]
+            table.angles = data["angles"]
+            table.table = {k: data[k] for k in FiringTable._fields}
+            table.env = None
+            if "env_g" in data:
+                dy = float(data["env_dy"])
+                density = data["env_density"] if data["env_density"].ndim else float(data["env_density"])
+                table.env = Environment(float(data["env_g"]), density, data["env_wind"].tolist(),
+                                        None if np.isnan(dy) else dy)
+        FiringTable.__fit(table)
+        return table
+
+
+# columns of the files written by export_trajectories, in the order of Tr.sample
+trajectory_columns = ("t", "x", "y", "vx", "vy")
+
+
+def _batch_rows(batch, i):
+    """Return a TrBatch of the bodies with indices i of batch."""
+    n = len(batch)
+    pos, vel = (np.broadcast_to(np.asarray(q, dtype=float), (n, 2))[i] for q in (batch.init_pos, batch.init_vel))
+    mass, area, c = (None if q is None else np.broadcast_to(np.asarray(q, dtype=float), n)[i]
+                     for q in (batch.mass, batch.area, batch.c))
+    rows = TrBatch(pos, vel, mass, area, c, batch.env)
+    rows.rtol = batch.rtol
+    rows.atol = batch.atol
+    return rows
+
+
+def _impact_time(body, air):
+    p = body.landing_point(air)
+    if p is None:
+        raise RuntimeError("No real solution was found.")
+    return p[2]
+
+
+def _export_chunks(bodies, t_end, n, dt, air, lengths, chunk_size):
+    """Yield the indices start, stop of every chunk of chunk_size bodies and their samples as a list of flat arrays
+    [t, x, y, vx, vy], one body after the other."""
+    for start in range(0, len(lengths), chunk_size):
+        stop = min(start + chunk_size, len(lengths))
+        if isinstance(bodies, TrBatch):
+            rows = _batch_rows(bodies, slice(start, stop))
+            if dt is None:
+                yield start, stop, [q.ravel() for q in rows.sample(t_end[start:stop], n, air)]
+            else:
+                m = lengths[start:stop]
+                j = np.arange(m.max())
+                t = np.minimum(j*dt, t_end[start:stop, None])
+                yield start, stop, [q[j < m[:, None]] for q in rows.states(t, air)]
+            continue
+        samples = []
+        for i in range(start, stop):
+            if dt is None:
+                samples.append(bodies[i].sample(t_end[i], n, air))
+            else:
+                samples.append([np.concatenate(q) for q in zip(*bodies[i].iter_states(t_end[i], dt, air))])
+        yield start, stop, [np.concatenate(q) for q in zip(*samples)]
+
+
+def export_trajectories(file, bodies, t_end=None, n=100, air=False, dt=None, format=None, chunk_size=1000):
+    """Write the sampled trajectories of one or more bodies to a columnar file that load_trajectories can read one
+    body at a time. bodies is a Tr, a sequence of Tr or a TrBatch. Every body is sampled from t=0 to t_end (a scalar,
+    one time per body, or None for its moment of impact) at n evenly spaced times, or every dt seconds if dt is given.
+    Set air=True to apply air resistance. The columns t, x, y, vx and vy hold the samples of all bodies, one body after
+    the other, and the array offsets holds the index of the first sample of every body followed by the total number of
+    samples. format is "npy" for a directory of .npy files that are written and read memory-mapped, "npz" for a NumPy
+    .npz file or "parquet" for a Parquet file with an extra column body (requires pyarrow); by default it is taken from
+    the extension of file, "npy" if there is none. Bodies are sampled and written chunk_size at a time.
+    Return offsets."""
+    if format is None:
+        format = {".npz": "npz", ".parquet": "parquet"}.get(os.path.splitext(str(file))[1].lower(), "npy")
+    if format not in ("npy", "npz", "parquet"):
+        raise ValueError("Unknown trajectory format: " + str(format))
+    if isinstance(bodies, Tr):
+        bodies = [bodies]
+    if t_end is None:
+        if isinstance(bodies, TrBatch):
+            t_end = bodies.landing_point(air)[2]
+            if np.isnan(t_end).any():
+                raise RuntimeError("No real solution was found.")
+        else:
+            t_end = [_impact_time(body, air) for body in bodies]
+    t_end = np.array(np.broadcast_to(np.asarray(t_end, dtype=float), len(bodies)))
+    if dt is None:
+        lengths = np.full(len(bodies), n, dtype=np.int64)
+    else:
+        lengths = (t_end/dt + 1e-9).astype(np.int64) + 1  # as in Tr.iter_states
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    chunks = _export_chunks(bodies, t_end, n, dt, air, lengths, chunk_size)
+
+    if format == "parquet":
+        import pyarrow
+        import pyarrow.parquet
+        schema = pyarrow.schema([("body", pyarrow.int64())] + [(name, pyarrow.float64()) for name in trajectory_columns])
+        with pyarrow.parquet.ParquetWriter(file, schema) as writer:
+            for start, stop, columns in chunks:  # one row group per chunk, so a reader can skip to one body
+                body = np.repeat(np.arange(start, stop), lengths[start:stop])
+                writer.write_table(pyarrow.Table.from_arrays([body] + columns, schema=schema))
+        return offsets
+    if format == "npy":
+        os.makedirs(file, exist_ok=True)
+        np.save(os.path.join(file, "offsets.npy"), offsets)
+        out = [np.lib.format.open_memmap(os.path.join(file, name + ".npy"), "w+", float, (int(offsets[-1]),))
+               for name in trajectory_columns]
+    else:
+        out = [np.empty(offsets[-1]) for _ in trajectory_columns]
+    for start, stop, columns in chunks:
+        for column, samples in zip(out, columns):
+            column[offsets[start]:offsets[stop]] = samples
+    if format == "npy":
+        for column in out:
+            column.flush()
+    else:
+        np.savez(file, offsets=offsets, **dict(zip(trajectory_columns, out)))
+    return offsets
+
+
+def load_trajectories(file, i=None):
+    """Return the samples of body i in a file written by export_trajectories as a list of NumPy arrays
+    [t, x, y, vx, vy], like Tr.sample. Only the samples of that body are read from .npy directories and Parquet files,
+    .npz files are read one whole column at a time. If i is None, return a dictionary of the columns and offsets of all
+    bodies instead, memory-mapped for .npy directories."""
+    if str(file).lower().endswith(".parquet"):
+        import pyarrow.parquet
+        if i is not None:
+            table = pyarrow.parquet.read_table(file, columns=list(trajectory_columns), filters=[("body", "=", i)])
+            return [table[name].to_numpy() for name in trajectory_columns]
+        table = pyarrow.parquet.read_table(file)
+        body = table["body"].to_numpy()
+        data = {name: table[name].to_numpy() for name in trajectory_columns}
+        data["offsets"] = np.searchsorted(body, np.arange(body[-1] + 2 if len(body) else 1))
+        return data
+    if os.path.isdir(file):
+        offsets = np.load(os.path.join(file, "offsets.npy"))
+        columns = [np.load(os.path.join(file, name + ".npy"), mmap_mode="r") for name in trajectory_columns]
+        if i is not None:
+            return [np.array(column[offsets[i]:offsets[i + 1]]) for column in columns]
+        data = dict(zip(trajectory_columns, columns))
+        data["offsets"] = offsets
+        return data
+    with np.load(file) as npz:
+        offsets = npz["offsets"]
+        if i is not None:
+            return [npz[name][offsets[i]:offsets[i + 1]] for name in trajectory_columns]
+        return {name: npz[name] for name in ("offsets",) + trajectory_columns}
@@ -0,0 +1,253 @@
+# Benchmarks for the module "trajectory". Every workload is deterministic (fixed bodies and a fixed random seed).
+# Run all benchmarks and print the results:       python trajectory_bench.py
+# Store the results as a baseline:                python trajectory_bench.py --save baseline.json
+# Compare with a baseline and flag slowdowns:     python trajectory_bench.py --compare baseline.json --threshold 0.2
+# Only run benchmarks whose name contains a word: python trajectory_bench.py football i_vel
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import trajectory
+
+SEED = 0
+
+
+def football():
+    """Return a football kicked at 20 m/s at 45°."""
+    body = trajectory.Tr()
+    body.init_pos = [0, 0]
+    body.init_vel = [20, 20]
+    body.area = 0.038
+    body.mass = 0.45
+    body.c = 0.25
+    return body
+
+
+def artillery():
+    """Return a 155 mm shell fired at 800 m/s at 45°."""
+    body = trajectory.Tr()
+    body.init_pos = [0, 0]
+    body.set_vel_trig(800, 45)
+    body.area = 0.01887
+    body.mass = 43.5
+    body.c = 0.3
+    return body
+
+
+def rifle():
+    """Return a 7.62 mm bullet fired at 850 m/s almost horizontally from 1.5 m, a flat-fire trajectory."""
+    body = trajectory.Tr()
+    body.init_pos = [0, 1.5]
+    body.init_vel = [850, 0.5]
+    body.area = 4.8e-5
+    body.mass = 0.0097
+    body.c = 0.3
+    return body
+
+
+def bodies(n=10000):
+    """Return n bodies with random speed, angle and mass."""
+    rng = np.random.default_rng(SEED)
+    batch = trajectory.TrBatch(mass=rng.uniform(0.3, 0.6, n), area=0.038, c=0.25)
+    batch.set_vel_trig(rng.uniform(10, 60, n), rng.uniform(5, 85, n))
+    return batch
+
+
+def bodies_3d(n=10000):
+    """Return n spinning bodies in three dimensions with random speed, angle, azimuth and mass."""
+    rng = np.random.default_rng(SEED)
+    batch = trajectory.Tr3D(mass=rng.uniform(0.3, 0.6, n), area=0.038, c=0.25, spin=(0, 0, 20), radius=0.11,
+                            env=trajectory.Environment(wind=(0, 0, 3)))
+    batch.set_vel_trig(rng.uniform(10, 60, n), rng.uniform(5, 85, n), rng.uniform(-10, 10, n))
+    return batch
+
+
+def population_frames(method, n=10000, frames=10):
+    """Add n bodies with random speed and angle to a Population and advance it by frames steps of 1/60 s."""
+    rng = np.random.default_rng(SEED)
+    speed = rng.uniform(10, 60, n)
+    a = rng.uniform(5, 85, n)*np.pi/180
+    population = trajectory.Population(n, method)
+    population.add((0, 0), np.stack([speed*np.cos(a), speed*np.sin(a)], -1), 0.45, 0.038, 0.25)
+    for _ in range(frames):
+        population.step(1/60)
+
+
+def add_plot(body, air):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    body.add_plot(body.landing_point(air)[2], air)
+    plt.close("all")
+
+
+def workloads():
+    """Return a dictionary of benchmark names and functions without arguments."""
+    w = {}
+    for name, make in [("football", football), ("artillery", artillery), ("rifle", rifle)]:
+        body = make()
+        x = body.landing_point()[0]
+        t = body.landing_point()[2]
+        for air in [False, True]:
+            mode = name + ("/air" if air else "/no_air")
+            w[mode + "/pos"] = lambda body=body, t=t, air=air: body.pos(t/2, air)
+            w[mode + "/v"] = lambda body=body, t=t, air=air: body.v(t/2, air)
+            w[mode + "/speed"] = lambda body=body, t=t, air=air: body.speed(t/2, air)
+            w[mode + "/landing_point"] = lambda body=body, air=air: body.landing_point(air)
+            w[mode + "/landing_gradient"] = lambda body=body, air=air: body.landing_gradient(air)
+            w[mode + "/max_alt"] = lambda body=body, air=air: body.max_alt(air)
+            w[mode + "/time_x"] = lambda body=body, x=x, air=air: body.time_x(x/4, air)
+            w[mode + "/tot_time"] = lambda body=body, air=air: body.tot_time(air)
+            w[mode + "/i_vel"] = lambda body=body, x=x, air=air: body.i_vel(x/2, 45, air)
+            w[mode + "/summary"] = lambda body=body, x=x, air=air: body.summary(air, [x/4, x/2], [1])
+            w[mode + "/sample"] = lambda body=body, t=t, air=air: body.sample(t, 101, air)
+            w[mode + "/iter_states"] = lambda body=body, t=t, air=air: [c for c in body.iter_states(t, t/1000, air)]
+            w[mode + "/add_plot"] = lambda body=body, air=air: add_plot(body, air)
+
+    batch = bodies()
+    for air in [False, True]:
+        mode = "sweep_10k" + ("/air" if air else "/no_air")
+        w[mode + "/landing_point"] = lambda air=air: batch.landing_point(air)
+        w[mode + "/max_alt"] = lambda air=air: batch.max_alt(air)
+    batch_3d = bodies_3d()
+    for air in [False, True]:
+        mode = "sweep_10k_3d" + ("/air" if air else "/no_air")
+        w[mode + "/landing_point"] = lambda air=air: batch_3d.landing_point(air)
+        w[mode + "/max_alt"] = lambda air=air: batch_3d.max_alt(air)
+    for method in ["rk4", "semi-implicit"]:
+        w["population_10k/%s/10_frames" % method] = lambda method=method: population_frames(method)
+    w["sweep_10k/air/sweep"] = lambda: trajectory.sweep(np.linspace(10, 60, 100), np.linspace(5, 85, 100), 0.45,
+                                                        0.038, 0.25, air=True, workers=1)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    w["import"] = lambda: subprocess.run([sys.executable, "-c", "import trajectory"], cwd=here, check=True)
+
+    body = football()
+    for method in ["secant", "brent", "bisect"]:
+        for tol in [1e-2, 1e-4, 1e-6]:
+            w["i_vel/%s/tol=%g" % (method, tol)] = lambda method=method, tol=tol: body.i_vel(40, 45, True, tol, method)
+    return w
+
+
+class _Counter:
+    """Count calls of the right-hand side of the drag ODE, for single bodies and batches."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __enter__(self):
+        rhs, jac = trajectory._drag_kernel()
+        self.kernel = trajectory._kernel
+        self.batch_rhs = trajectory._drag_rhs
+        self.rhs_into = trajectory._drag_rhs_into
+
+        def counted_rhs(*args):
+            self.calls += 1
+            return rhs(*args)
+
+        def counted_batch_rhs(r, *args):
+            self.calls += r.shape[1] if r.ndim > 1 else 1
+            return self.batch_rhs(r, *args)
+
+        def counted_rhs_into(r, *args):
+            self.calls += r.shape[1]
+            return self.rhs_into(r, *args)
+
+        trajectory._kernel = (counted_rhs, jac)
+        trajectory._drag_rhs = counted_batch_rhs
+        trajectory._drag_rhs_into = counted_rhs_into
+        return self
+
+    def __exit__(self, *exc):
+        trajectory._kernel = self.kernel
+        trajectory._drag_rhs = self.batch_rhs
+        trajectory._drag_rhs_into = self.rhs_into
+
+
+def measure(f, min_time=0.2, repeat=3):
+    """Return time per call in seconds (best of repeat), right-hand side evaluations per call and peak memory
+    allocated during one call in bytes."""
+    with _Counter() as counter:
+        f()
+    tracemalloc.start()
+    f()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time/repeat or number >= 1000000:
+            break
+        number *= 10
+    best = elapsed/number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        best = min(best, (time.perf_counter() - start)/number)
+    return {"time": best, "rhs": counter.calls, "peak_memory": peak}
+
+
+def run(names=(), min_time=0.2):
+    """Run the benchmarks whose name contains any of the given words (all if none) and return the results as a
+    dictionary that can be stored with json."""
+    results = {}
+    for name, f in workloads().items():
+        if names and not any(word in name for word in names):
+            continue
+        results[name] = measure(f, min_time)
+        r = results[name]
+        print("%-40s %12.3f us %10d rhs %12d B" % (name, r["time"]*1e6, r["rhs"], r["peak_memory"]))
+    import scipy
+    meta = {"python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__,
+            "machine": platform.machine(), "kernel_backend": trajectory.kernel_backend, "seed": SEED}
+    return {"meta": meta, "results": results}
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return a list of [name, ratio] for every benchmark that is more than threshold (as a fraction) slower than in
+    the baseline."""
+    slower = []
+    for name, r in results["results"].items():
+        if name in baseline["results"]:
+            ratio = r["time"]/baseline["results"][name]["time"]
+            if ratio > 1 + threshold:
+                slower.append([name, ratio])
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the module trajectory.")
+    parser.add_argument("names", nargs="*", help="only run benchmarks whose name contains one of these words")
+    parser.add_argument("--save", help="store the results in this JSON file")
+    parser.add_argument("--compare", help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown as a fraction, default 0.2")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to spend on each benchmark")
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.min_time)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, args.threshold)
+        for name, ratio in slower:
+            print("SLOWER %-40s %.2fx" % (name, ratio))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
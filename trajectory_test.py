@@ -1,4 +1,11 @@
 import trajectory as t
+import asyncio
+import io
+import math
+import numpy as np
+import os
+import subprocess
+import sys
 import unittest
 
 class BasicTests(unittest.TestCase):
@@ -260,5 +267,941 @@ class BasicTests(unittest.TestCase):
         self.assertAlmostEqual(y2, football.pos(t2)[1], delta=0.01)
         self.assertAlmostEqual(football.time_x(x2), t2, delta=0.01)
 
+    def testcase7(self):
+        """sampled trajectory, with and without air resistance"""
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        for air in [False, True]:
+            s = football.sample(3, 31, air)
+            self.assertEqual(len(s), 5)
+            self.assertEqual(len(s[0]), 31)
+            self.assertAlmostEqual(s[0][-1], 3, delta=0.0001)
+            for i in [0, 10, 30]:
+                self.assertAlmostEqual(s[1][i], football.pos(s[0][i], air)[0], delta=0.01)
+                self.assertAlmostEqual(s[2][i], football.pos(s[0][i], air)[1], delta=0.01)
+                self.assertAlmostEqual(s[3][i], football.v(s[0][i], air)[0], delta=0.01)
+                self.assertAlmostEqual(s[4][i], football.v(s[0][i], air)[1], delta=0.01)
+
+        # answers are compared with results from Mathematica
+        s = football.sample(3, 2, True)
+        self.assertAlmostEqual(s[1][-1], 42.766, delta=0.01)
+        self.assertAlmostEqual(s[2][-1], 6.235, delta=0.01)
+
+        # an empty interval gives the initial state
+        for air in [False, True]:
+            s = football.sample(0, 5, air)
+            for q, r in zip(s, [0, 0, 0, 20, 20]):
+                self.assertTrue(np.array_equal(q, np.full(5, r)))
+
+    def testcase8(self):
+        """batch of footballs, with and without air resistance"""
+        # answers are compared with results from Mathematica
+        batch = t.TrBatch([[0, 0], [-25, 10], [0, 10], [0, -10]], [[20, 20], [15, -5], [0, 0], [0, 0]], 0.45, 0.038, 0.25)
+
+        # position
+        p = batch.pos(3, True)
+        self.assertAlmostEqual(p[0][0], 42.766, delta=0.01)
+        self.assertAlmostEqual(p[1][0], 6.235, delta=0.01)
+        self.assertAlmostEqual(p[0][1], 7.679, delta=0.01)
+        self.assertAlmostEqual(p[1][1], -35.878, delta=0.01)
+        self.assertAlmostEqual(p[1][2], -27.71, delta=0.01)
+
+        # velocity
+        v = batch.v(3, True)
+        self.assertAlmostEqual(v[0][0], 10.585, delta=0.01)
+        self.assertAlmostEqual(v[1][1], -22.585, delta=0.01)
+
+        # landing point
+        x1, y1, t1 = batch.landing_point(True)
+        self.assertAlmostEqual(x1[0], 47.415, delta=0.01)
+        self.assertAlmostEqual(t1[0], 3.461, delta=0.01)
+        self.assertAlmostEqual(x1[1], -10.61, delta=0.01)
+        self.assertAlmostEqual(t1[1], 1.069, delta=0.01)
+        self.assertAlmostEqual(t1[2], 1.45, delta=0.01)
+        self.assertTrue(math.isnan(x1[3]))  # body never lands
+        self.assertAlmostEqual(batch.time_x(x1[0], True)[0], t1[0], delta=0.01)
+
+        # max altitude
+        x2, y2, t2 = batch.max_alt(True)
+        self.assertAlmostEqual(y2[0], 14.786, delta=0.01)
+        self.assertAlmostEqual(y2[1], 10, delta=0.01)
+
+        # no air resistance
+        football = t.Tr()
+        football.init_pos = [-25, 10]
+        football.init_vel = [15, -5]
+        x1, y1, t1 = t.batch_landing_point([[0, 0], [-25, 10]], [[20, 20], [15, -5]])
+        self.assertAlmostEqual(x1[0], 81.63, delta=0.01)
+        self.assertAlmostEqual(x1[1], football.landing_point()[0], delta=0.0001)
+        self.assertAlmostEqual(t1[1], football.landing_point()[2], delta=0.0001)
+
+        # missing drag properties
+        with self.assertRaises(RuntimeError):
+            t.batch_landing_point([0, 0], [[20, 20]], air=True)
+
+    def testcase9(self):
+        """parameter sweep over a process pool"""
+        speeds = [10, 20, 30]
+        angles = [30, 45, 60]
+        masses = [0.45, 0.9]
+        result = t.sweep(speeds, angles, masses, 0.038, 0.25, air=True, workers=1)
+        self.assertEqual(len(result), 18)
+
+        football = t.Tr()
+        football.area = 0.038
+        football.c = 0.25
+        for row in result[[0, 7, 17]]:
+            football.mass = row["mass"]
+            football.set_vel_trig(row["speed"], row["angle"])
+            self.assertAlmostEqual(row["x"], football.landing_point(True)[0], delta=0.01)
+            self.assertAlmostEqual(row["y_max"], football.max_alt(True)[1], delta=0.01)
+
+        # results do not depend on the number of workers or the size of the chunks
+        parallel = t.sweep(speeds, angles, masses, 0.038, 0.25, air=True, workers=2, chunk_size=4)
+        self.assertTrue((parallel == result).all())
+        chunks = list(t.sweep(speeds, angles, masses, 0.038, 0.25, air=True, workers=2, chunk_size=5, stream=True))
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 5, 3])
+        self.assertTrue((np.concatenate(chunks) == result).all())
+
+    def testcase10(self):
+        """initial speed with air resistance, different root finding methods"""
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        solves = {}
+        for method in ["bisect", "secant", "brent"]:
+            v, solves[method] = football.i_vel(47.415, 45, True, 0.0001, method, full_output=True)
+            self.assertAlmostEqual(v, (2*20**2)**0.5, delta=0.01)
+        self.assertLess(solves["secant"], solves["bisect"])
+        self.assertLess(solves["brent"], solves["bisect"])
+
+        with self.assertRaises(ValueError):
+            football.i_vel(47.415, 45, True, method="newtonian")
+
+    def testcase11(self):
+        """firing table, air resistance"""
+        # answers are compared with results from Mathematica
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+        table = t.FiringTable(football, np.linspace(10, 40, 13), np.linspace(10, 80, 15))
+
+        # forward queries
+        p, err = table.landing_point((2*20**2)**0.5, 45, full_output=True)
+        self.assertAlmostEqual(p[0], 47.415, delta=0.01)
+        self.assertAlmostEqual(p[2], 3.461, delta=0.01)
+        self.assertLess(err[0], 0.01)
+        self.assertAlmostEqual(table.max_alt((2*20**2)**0.5, 45)[1], 14.786, delta=0.01)
+
+        # inverse queries
+        self.assertAlmostEqual(table.i_vel(47.415, 45), (2*20**2)**0.5, delta=0.01)
+        self.assertAlmostEqual(table.tot_time_for_range(47.415, 45), 3.461, delta=0.01)
+
+        # outside of the table
+        football.set_vel_trig(50, 45)
+        self.assertAlmostEqual(table.landing_point(50, 45)[0], football.landing_point(True)[0], delta=0.0001)
+        p, err = table.landing_point(50, 45, full_output=True)
+        self.assertAlmostEqual(err[0], 1e-3*p[0] + 1e-6, delta=1e-9)  # tolerances of the body
+        x = football.landing_point(True)[0]
+        self.assertAlmostEqual(table.i_vel(x, 45, tol=0.0001), 50, delta=0.01)
+
+        # save and load
+        f = io.BytesIO()
+        table.save(f)
+        f.seek(0)
+        loaded = t.FiringTable.load(f)
+        self.assertEqual(loaded.landing_point(30, 50), table.landing_point(30, 50))
+        self.assertEqual(loaded.landing_point(50, 45), table.landing_point(50, 45))
+
+        # the table is computed with the solver settings of the body, so results agree at its edge
+        football.rtol = 1e-8
+        football.atol = 1e-8
+        table = t.FiringTable(football, np.linspace(10, 40, 7), np.linspace(10, 80, 7))
+        self.assertEqual([table.rtol, table.atol, table.method], [1e-8, 1e-8, "RK45"])
+        self.assertAlmostEqual(table.landing_point(40.0001, 45)[0], table.landing_point(40, 45)[0], delta=1e-3)
+
+    def testcase12(self):
+        """cached trajectories, air resistance"""
+        # answers are compared with results from Mathematica
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+        football.cache = t.SolutionCache(2)
+
+        self.assertAlmostEqual(football.pos(3, True)[0], 42.766, delta=0.01)
+        self.assertAlmostEqual(football.v(3, True)[1], -11.902, delta=0.01)
+        x1 = football.landing_point(True)[0]
+        t1 = football.landing_point(True)[2]
+        self.assertAlmostEqual(x1, 47.415, delta=0.01)
+        self.assertAlmostEqual(t1, 3.461, delta=0.01)
+        self.assertAlmostEqual(football.max_alt(True)[1], 14.786, delta=0.01)
+        self.assertAlmostEqual(football.time_x(x1, True), t1, delta=0.01)
+        self.assertAlmostEqual(football.pos(t1, True)[1], 0, delta=0.01)
+        self.assertEqual(football.cache.misses, 1)  # one integration serves every query
+        self.assertEqual(football.cache.hits, 6)
+
+        # changing the body invalidates the trajectory
+        football.init_pos = [-25, 10]
+        football.init_vel = [15, -5]
+        self.assertAlmostEqual(football.landing_point(True)[0], -10.61, delta=0.01)
+        self.assertAlmostEqual(football.pos(3, True)[1], -35.878, delta=0.01)
+        self.assertEqual(football.cache.misses, 2)
+
+        # least recently used trajectories are evicted
+        football.init_vel = [20, 20]
+        football.landing_point(True)
+        football.init_pos = [0, 0]
+        football.landing_point(True)
+        self.assertEqual(len(football.cache), 2)
+        self.assertEqual(football.cache.misses, 4)
+        football.cache.clear()
+        self.assertEqual(len(football.cache), 0)
+
+    def testcase13(self):
+        """solver methods and tolerances, air resistance"""
+        # answers are compared with results from Mathematica
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        for method in ["RK45", "DOP853", "LSODA", "Radau"]:
+            football.method = method
+            football.rtol = 1e-8
+            football.atol = 1e-10
+            self.assertAlmostEqual(football.pos(3, True)[0], 42.766, delta=0.001)
+            self.assertAlmostEqual(football.landing_point(True)[0], 47.415, delta=0.001)
+            self.assertAlmostEqual(football.max_alt(True)[1], 14.786, delta=0.001)
+
+        # analytic Jacobian
+        k = 0.5*t.p*0.25*0.038/0.45
+        r = np.array([12.0, 3.0, -7.0, 5.0])
+        jac = t._drag_jac(0, r, k, t.g)
+        for i in range(4):
+            dr = np.zeros(4)
+            dr[i] = 1e-6
+            df = (np.array(t._drag_rhs_1(0, r + dr, k, t.g)) - np.array(t._drag_rhs_1(0, r - dr, k, t.g)))/2e-6
+            for j in range(4):
+                self.assertAlmostEqual(jac[j, i], df[j], delta=1e-6)
+
+    def testcase14(self):
+        """flight summary, with and without air resistance"""
+        # answers are compared with results from Mathematica
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        for air in [False, True]:
+            s = football.summary(air, [10, 40, 1000], [5, 1000])
+            self.assertAlmostEqual(s["apex"][0], football.max_alt(air)[2], delta=0.01)
+            self.assertAlmostEqual(s["apex"][2], football.max_alt(air)[1], delta=0.01)
+            self.assertAlmostEqual(s["impact"][0], football.landing_point(air)[2], delta=0.01)
+            self.assertAlmostEqual(s["impact"][1], football.landing_point(air)[0], delta=0.01)
+            self.assertAlmostEqual(s["x"][0][0], football.time_x(10, air), delta=0.01)
+            self.assertAlmostEqual(s["x"][1][0], football.time_x(40, air), delta=0.01)
+            self.assertIsNone(s["x"][2])  # beyond the landing point
+            self.assertEqual(len(s["y"][0]), 2)  # once on the way up and once on the way down
+            self.assertEqual(len(s["y"][1]), 0)
+            for e in s["y"][0]:
+                self.assertAlmostEqual(e[2], 5, delta=0.0001)
+                self.assertAlmostEqual(e[1], football.pos(e[0], air)[0], delta=0.01)
+
+        s = football.summary(True)
+        self.assertAlmostEqual(s["impact"][1], 47.415, delta=0.01)
+        self.assertAlmostEqual(s["apex"][2], 14.786, delta=0.01)
+
+    def testcase15(self):
+        """cheap import, SciPy and matplotlib are loaded on first use"""
+        code = ("import sys, trajectory; "
+                "b = trajectory.Tr(); b.init_vel = [20, 20]; b.landing_point(); "
+                "print('scipy' in sys.modules, 'matplotlib' in sys.modules, trajectory.kernel_backend); "
+                "b.area, b.mass, b.c = 0.038, 0.45, 0.25; b.landing_point(True); "
+                "print('scipy' in sys.modules, 'matplotlib' in sys.modules, trajectory.kernel_backend)")
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(t.__file__))).stdout.split()
+        self.assertEqual(out[:3], ["False", "False", "None"])
+        self.assertEqual(out[3:5], ["True", "False"])
+        self.assertIn(out[5], ["python", "numba"])
+
+    def testcase16(self):
+        """streamed trajectory, with and without air resistance"""
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        for air in [False, True]:
+            chunks = list(football.iter_states(3, 0.01, air, chunk_size=64))
+            self.assertEqual([len(c[0]) for c in chunks], [64, 64, 64, 64, 45])
+            states = np.hstack([np.array(c) for c in chunks])
+            s = football.sample(3, 301, air)
+            for i in range(5):
+                self.assertLess(abs(states[i] - s[i]).max(), 0.0001)
+
+        # answers are compared with results from Mathematica
+        last = list(football.iter_states(3, 0.5, True))[-1]
+        self.assertAlmostEqual(last[0][-1], 3, delta=0.0001)
+        self.assertAlmostEqual(last[1][-1], 42.766, delta=0.01)
+        self.assertAlmostEqual(last[2][-1], 6.235, delta=0.01)
+
+    def testcase17(self):
+        """benchmark measurement and comparison with a baseline"""
+        import trajectory_bench
+        football = trajectory_bench.football()
+        r = trajectory_bench.measure(lambda: football.landing_point(True), min_time=0.01)
+        self.assertGreater(r["time"], 0)
+        self.assertGreater(r["rhs"], 0)
+        self.assertEqual(trajectory_bench.measure(lambda: football.landing_point(), min_time=0.01)["rhs"], 0)
+
+        baseline = {"results": {"a": {"time": 1.0}, "b": {"time": 1.0}}}
+        results = {"results": {"a": {"time": 1.1}, "b": {"time": 1.5}, "c": {"time": 9.0}}}
+        self.assertEqual(trajectory_bench.compare(results, baseline, 0.2), [["b", 1.5]])
+
+    def testcase18(self):
+        """instrumentation of integrations, root searches and cache lookups"""
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        records = []
+        with t.instrument(records.append) as stats:
+            football.landing_point(True)
+        self.assertEqual(stats.calls, 1)
+        self.assertEqual(records[0]["kind"], "solve")
+        self.assertGreater(stats.time, 0)
+        self.assertEqual(stats.nfev, 2 + 6*(stats.steps + stats.rejected))  # RK45 evaluates 6 stages per step
+
+        # streamed integrations are recorded too, also when stopped early
+        with t.instrument() as stats:
+            list(football.iter_states(3, 0.01, True))
+            states = football.iter_states(3, 0.01, True, chunk_size=10)
+            next(states)
+            states.close()
+        self.assertEqual(stats.calls, 2)
+        self.assertGreater(stats.nfev, 0)
+        self.assertGreater(stats.steps, 0)
+
+        # and are stopped by the cancellation of the request they run for
+        cancellation = t._Cancellation()
+        cancellation.cancelled = True
+        t._local.cancellation = cancellation
+        try:
+            with self.assertRaises(RuntimeError):
+                list(football.iter_states(3, 0.01, True))
+        finally:
+            t._local.cancellation = None
+
+        with t.instrument() as stats:
+            v, n = football.i_vel(40, 45, True, full_output=True)
+        self.assertEqual(stats.root_iterations, n)
+        self.assertLessEqual(stats.calls, n)
+
+        with t.instrument() as stats:
+            football.cache = t.SolutionCache()
+            football.landing_point(True)
+            football.max_alt(True)
+            t.TrBatch([0, 0], [[20, 20], [30, 30]], 0.45, 0.038, 0.25).landing_point(True)
+        self.assertEqual(stats.cache_hits, 1)
+        self.assertEqual(stats.cache_misses, 1)
+        self.assertEqual(stats.calls, 2)
+
+        # nothing is recorded outside of instrument()
+        football.cache = None
+        football.landing_point(True)
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(len(records), 1)
+
+    def testcase19(self):
+        """compact bodies and output buffers, no air resistance"""
+        football = t.Tr()
+        self.assertFalse(hasattr(football, "__dict__"))
+        with self.assertRaises(AttributeError):
+            football.colour = "red"
+
+        rng = np.random.default_rng(0)
+        batch = t.TrBatch(rng.uniform(-5, 5, (1000, 2)), rng.uniform(-30, 30, (1000, 2)))
+        for method, rows, args in [(batch.pos, 2, (1.5,)), (batch.v, 2, (1.5,)),
+                                   (batch.landing_point, 3, ()), (batch.max_alt, 3, ())]:
+            out = np.empty((rows, 1000))
+            self.assertIs(method(*args, out=out), out)
+            self.assertTrue(np.allclose(out, np.array(method(*args)), equal_nan=True))
+
+        i = np.flatnonzero(~np.isnan(batch.landing_point()[0]))[0]
+        football.init_pos = list(batch.init_pos[i])
+        football.init_vel = list(batch.init_vel[i])
+        self.assertAlmostEqual(out[1][i], football.max_alt()[1], delta=0.0001)
+        self.assertAlmostEqual(batch.landing_point()[2][i], football.landing_point()[2], delta=0.0001)
+
+    def testcase20(self):
+        """closed-form solutions for vertical and flat trajectories, air resistance"""
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [0, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+        k = 0.5*t.p*0.25*0.038/0.45
+        vt = (t.g/k)**0.5  # terminal speed
+        h = vt**2/(2*t.g)*math.log(1 + 20**2/vt**2)
+        t_max = vt/t.g*math.atan(20/vt)
+        t_fall = vt/t.g*math.acosh(math.exp(h*t.g/vt**2))
+
+        reference = t.Tr()
+        for name in ["init_pos", "init_vel", "area", "mass", "c"]:
+            setattr(reference, name, getattr(football, name))
+        reference.analytic = False
+        reference.rtol = 1e-10
+        reference.atol = 1e-12
+
+        with t.instrument() as stats:
+            self.assertAlmostEqual(football.max_alt(True)[1], h, delta=1e-9)
+            self.assertAlmostEqual(football.max_alt(True)[2], t_max, delta=1e-9)
+            self.assertAlmostEqual(football.tot_time(True), t_max + t_fall, delta=1e-9)
+            self.assertAlmostEqual(football.pos(5, True)[1], reference.pos(5, True)[1], delta=1e-6)
+            self.assertAlmostEqual(football.v(5, True)[1], reference.v(5, True)[1], delta=1e-6)
+        self.assertEqual(stats.calls, 2)  # only the reference is integrated
+
+        football.init_vel = [0, -60]  # faster than terminal speed
+        football.init_pos = [0, 100]
+        reference.init_vel = football.init_vel
+        reference.init_pos = football.init_pos
+        self.assertAlmostEqual(football.tot_time(True), reference.tot_time(True), delta=1e-6)
+        self.assertAlmostEqual(football.speed(1, True), reference.speed(1, True), delta=1e-6)
+
+        # flat fire: a bullet shot almost horizontally, the error is below rtol times the distance travelled
+        for body in [football, reference]:
+            body.init_pos = [0, 1.5]
+            body.init_vel = [850, 0.5]
+            body.area = 4.8e-5
+            body.mass = 0.0097
+            body.c = 0.3
+        x, y, t1 = football.landing_point(True)
+        self.assertAlmostEqual(x, reference.landing_point(True)[0], delta=1e-3*x)
+        self.assertAlmostEqual(t1, reference.landing_point(True)[2], delta=1e-3*t1)
+        self.assertAlmostEqual(football.max_alt(True)[1], reference.max_alt(True)[1], delta=1e-3)
+        self.assertAlmostEqual(football.time_x(300, True), reference.time_x(300, True), delta=1e-6)
+        self.assertIsNone(football.time_x(1e6, True))  # out of reach, where the flat-fire time overflows
+        with t.instrument() as stats:
+            football.landing_point(True)
+            football.pos(0.3, True)
+            football.rtol = 1e-8  # too steep for this tolerance, integrate instead
+            football.landing_point(True)
+            football.rtol = 1e-3
+            football.analytic = False
+            football.landing_point(True)
+        self.assertEqual(stats.calls, 2)
+
+    def testcase21(self):
+        """asynchronous methods, coalescing of identical requests, timeouts and cancellation"""
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [20, 20]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+
+        async def run():
+            self.assertEqual(await football.alanding_point(), football.landing_point())
+            self.assertEqual(await football.alanding_point(True), football.landing_point(True))
+            self.assertEqual(await football.amax_alt(True), football.max_alt(True))
+            self.assertEqual(await football.atime_x(20, True), football.time_x(20, True))
+            self.assertEqual(await football.apos(2, True), football.pos(2, True))
+            self.assertEqual(await football.av(2, True), football.v(2, True))
+            self.assertEqual(await football.ai_vel(40, 45, True), football.i_vel(40, 45, True))
+            with self.assertRaises(RuntimeError):
+                await football.ai_vel(10, -90, True)
+
+            # identical requests in flight are integrated once
+            with t.instrument() as stats:
+                results = await asyncio.gather(*[football.alanding_point(True) for _ in range(5)])
+            self.assertEqual(stats.calls, 1)
+            self.assertEqual(results, [football.landing_point(True)]*5)
+
+            # a timed out integration stops and frees its worker
+            football.rtol = 1e-12
+            football.atol = 1e-14
+            with self.assertRaises(asyncio.TimeoutError):
+                await football.ai_vel(40, 45, True, tol=1e-10, timeout=0.05)
+            loop = asyncio.get_running_loop()
+            await asyncio.wait_for(loop.run_in_executor(t.executor, lambda: None), 0.5)
+
+            # cancelling one of two identical requests does not cancel the other
+            first = asyncio.ensure_future(football.ai_vel(40, 45, True, tol=1e-6))
+            second = asyncio.ensure_future(football.ai_vel(40, 45, True, tol=1e-6))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            self.assertAlmostEqual(await second, 24.772, delta=0.001)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(len(t._requests[loop]), 0)
+
+        t.executor = ThreadPoolExecutor(1)
+        try:
+            asyncio.run(run())
+        finally:
+            t.executor.shutdown()
+            t.executor = None
+
+        # process pools get a copy of the body, and requests that have not started when cancelled are dropped
+        async def run_in_processes():
+            self.assertEqual(await football.alanding_point(True), football.landing_point(True))
+            football.rtol = 1e-12
+            football.atol = 1e-14
+            first = asyncio.ensure_future(football.ai_vel(40, 45, True, tol=1e-10))
+            second = asyncio.ensure_future(football.ai_vel(40, 40, True, tol=1e-10))
+            await asyncio.sleep(0.01)
+            second.cancel()
+            first.cancel()
+            await asyncio.gather(first, second, return_exceptions=True)
+            self.assertEqual(len(t._requests[asyncio.get_running_loop()]), 0)
+
+        t.executor = ProcessPoolExecutor(1)
+        try:
+            asyncio.run(run_in_processes())
+        finally:
+            t.executor.shutdown(cancel_futures=True)
+            t.executor = None
+
+    def testcase22(self):
+        """optimal angle and angles for a range, with and without air resistance"""
+        football = t.Tr()
+        football.init_pos = [0, 10]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+        football.rtol = 1e-6
+        football.atol = 1e-9
+
+        # without air resistance, compared with the closed-form range
+        a, x = football.optimal_angle(20)
+        self.assertAlmostEqual(a, math.atan(20/(20**2 + 2*t.g*10)**0.5)*180/math.pi, delta=1e-9)
+        for da in [-1, 1]:
+            football.set_vel_trig(20, a + da)
+            self.assertLess(football.landing_point()[0], x)
+        for a in football.angles_for_range(30, 20):
+            football.set_vel_trig(20, a)
+            self.assertAlmostEqual(football.landing_point()[0], 30, delta=1e-9)
+
+        # with air resistance
+        a, x = football.optimal_angle(20, True)
+        self.assertAlmostEqual(a, 34.93, delta=0.01)
+        for da in [-1, 1]:
+            football.set_vel_trig(20, a + da)
+            self.assertLess(football.landing_point(True)[0], x)
+        low, high = football.angles_for_range(20, 20, True)
+        self.assertLess(low, a)
+        self.assertGreater(high, a)
+        for a in [low, high]:
+            football.set_vel_trig(20, a)
+            self.assertAlmostEqual(football.landing_point(True)[0], 20, delta=0.02)
+        low, high = football.angles_for_range(-20, 20, True)
+        football.set_vel_trig(20, high)
+        self.assertAlmostEqual(football.landing_point(True)[0], -20, delta=0.02)
+        with self.assertRaises(RuntimeError):
+            football.angles_for_range(40, 20, True)
+
+        # many speeds at once give the same angles
+        batch = t.TrBatch([0, 10], None, 0.45, 0.038, 0.25)
+        batch.set_vel_trig([15, 20, 25], 45)
+        a, x = batch.optimal_angle(True)
+        self.assertAlmostEqual(a[1], football.optimal_angle(20, True)[0], delta=0.01)
+        self.assertAlmostEqual(x[1], football.optimal_angle(20, True)[1], delta=0.001)
+        low, high = batch.angles_for_range([20, 20, 60], True)
+        self.assertAlmostEqual(low[1], football.angles_for_range(20, 20, True)[0], delta=0.01)
+        self.assertAlmostEqual(high[1], football.angles_for_range(20, 20, True)[1], delta=0.01)
+        self.assertTrue(np.isnan(low[2]) and np.isnan(high[2]))
+        self.assertTrue(np.allclose(batch.angles_for_range(30)[0][1], football.angles_for_range(30, 20)[0]))
+
+        # a tailwind towards +x is a headwind for targets behind the body, so the angles are not mirrored
+        football.env = t.Environment(wind=(5, 0))
+        batch = t.TrBatch([0, 10], [[20, 0], [20, 0]], 0.45, 0.038, 0.25, football.env)
+        low, high = football.angles_for_range(-20, 20, True)
+        self.assertNotAlmostEqual(180 - low, football.angles_for_range(20, 20, True)[0], delta=0.1)
+        for a in [low, high]:
+            football.set_vel_trig(20, a)
+            self.assertAlmostEqual(football.landing_point(True)[0], -20, delta=0.02)
+        a = batch.angles_for_range([-20, 20], True)
+        self.assertAlmostEqual(a[0][0], low, delta=0.01)
+        self.assertAlmostEqual(a[1][0], high, delta=0.01)
+        self.assertAlmostEqual(a[0][1], football.angles_for_range(20, 20, True)[0], delta=0.01)
+
+    def testcase23(self):
+        """environment with gravity, air density and wind"""
+        shell = t.Tr()
+        shell.set_vel_trig(800, 45)
+        shell.area = 0.01887
+        shell.mass = 43.5
+        shell.c = 0.3
+        shell.rtol = 1e-8
+        shell.atol = 1e-8
+        x = shell.landing_point(True)[0]
+        shell.env = t.Environment()
+        self.assertEqual(shell.landing_point(True)[0], x)
+
+        # standard atmosphere, compared with tabulated values of the International Standard Atmosphere
+        isa = t.standard_atmosphere()
+        for h, rho in [(0, 1.2250), (1000, 1.1117), (11000, 0.36391), (20000, 0.08803), (47000, 0.0014275)]:
+            self.assertAlmostEqual(float(isa.density_at(h)), rho, delta=1e-4*rho)
+        shell.env = isa
+        x_isa, y, t_isa = shell.landing_point(True)
+        self.assertGreater(x_isa, 1.2*x)  # thinner air at the apex
+        shell.method = "Radau"
+        self.assertAlmostEqual(shell.landing_point(True)[0], x_isa, delta=0.01)
+        batch = t.TrBatch(mass=43.5, area=0.01887, c=0.3, env=isa)
+        batch.set_vel_trig(800, 45)
+        batch.rtol = 1e-8
+        batch.atol = 1e-8
+        self.assertAlmostEqual(batch.landing_point(True)[0][0], x_isa, delta=0.01)
+
+        # wind: a body moving with the wind feels no drag
+        football = t.Tr()
+        football.init_pos = [0, 0]
+        football.init_vel = [10, 10]
+        football.area = 0.038
+        football.mass = 0.45
+        football.c = 0.25
+        football.env = t.Environment(wind=(10, 0))
+        self.assertAlmostEqual(football.pos(0.1, True)[0], 1, delta=1e-6)
+        football.env = t.Environment(wind=(-5, 0))
+        head = football.landing_point(True)[0]
+        football.env = t.Environment(wind=(5, 0))
+        self.assertGreater(football.landing_point(True)[0], head)
+        batch = t.TrBatch([0, 0], [10, 10], 0.45, 0.038, 0.25, football.env)
+        self.assertAlmostEqual(batch.landing_point(True)[0][0], football.landing_point(True)[0], delta=0.01)
+
+        # a strong headwind blows the body back past x, which is reached first on the way out
+        football.init_vel = [20, 20]
+        football.env = t.Environment(wind=(-30, 0))
+        self.assertLess(football.landing_point(True)[0], 0)
+        t_x = football.time_x(5, True)
+        self.assertAlmostEqual(t_x, 0.331, delta=0.001)
+        football.cache = t.SolutionCache()
+        football.landing_point(True)
+        self.assertAlmostEqual(football.time_x(5, True), t_x, delta=1e-6)
+        self.assertIsNone(football.time_x(50, True))
+        football.cache = None
+        self.assertIsNone(football.time_x(50, True))
+        football.init_vel = [10, 10]
+
+        # gravity also applies without air resistance, and an empty environment has no drag
+        football.env = t.Environment(g=1.62, density=0)
+        self.assertAlmostEqual(football.landing_point()[2], 20/1.62, delta=1e-9)
+        self.assertAlmostEqual(football.landing_point(True)[0], 200/1.62, delta=0.01)
+        self.assertAlmostEqual(football.i_vel(40, 45), (40*1.62)**0.5, delta=1e-9)
+
+        # density tables need a height step and at least two entries
+        self.assertRaises(ValueError, t.Environment, density=[1.2, 1.1])
+        self.assertRaises(ValueError, t.Environment, density=1.2, dy=100)
+        self.assertRaises(ValueError, t.Environment, density=[1.2], dy=100)
+
+    def testcase24(self):
+        """queries from several threads give the same results as from one thread"""
+        import threading
+        import time
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        from matplotlib.figure import Figure
+
+        def query(speed, cache=None, env=None):
+            body = t.Tr()
+            body.set_vel_trig(speed, 50)
+            body.area = 0.038
+            body.mass = 0.45
+            body.c = 0.25
+            body.cache = cache
+            body.env = env
+            x = body.landing_point(True)[0]
+            return [body.pos(1, True), body.v(1, True), body.landing_point(True), body.max_alt(True),
+                    body.time_x(x/2, True), body.i_vel(x, 30, True)]
+
+        speeds = [10 + i for i in range(48)]
+        wind = t.Environment(wind=(-3, 0))
+        serial = [query(s) for s in speeds]
+        serial_wind = [query(s, env=wind) for s in speeds]
+        cache = t.SolutionCache(16)
+        with ThreadPoolExecutor(8) as pool:
+            threaded = list(pool.map(query, speeds))
+            threaded_wind = list(pool.map(lambda s: query(s, env=wind), speeds))
+            cached = list(pool.map(lambda s: query(s, cache), speeds + speeds))
+        self.assertEqual(threaded, serial)
+        self.assertEqual(threaded_wind, serial_wind)
+        self.assertGreater(cache.hits, len(speeds))
+        for a, b in zip(cached, serial + serial):
+            self.assertTrue(np.allclose(np.hstack(a), np.hstack(b), rtol=1e-2, atol=1e-2))
+
+        # plots are drawn on the axes of each thread
+        figures = [Figure() for _ in range(4)]
+
+        def plot(fig):
+            ax = fig.add_subplot()
+            for s in speeds[:5]:
+                body = t.Tr()
+                body.set_vel_trig(s, 45)
+                body.add_plot(2*s/9.8, ax=ax)
+            return len(ax.lines)
+        with ThreadPoolExecutor(4) as pool:
+            self.assertEqual(list(pool.map(plot, figures)), [5, 5, 5, 5])
+
+        # without the GIL the work is spread over the cores
+        if not getattr(sys, "_is_gil_enabled", lambda: True)() and (os.cpu_count() or 1) >= 4:
+            start = time.perf_counter()
+            for s in speeds:
+                query(s)
+            one = time.perf_counter() - start
+            start = time.perf_counter()
+            threads = [threading.Thread(target=lambda i=i: [query(s) for s in speeds[i::4]]) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertLess(time.perf_counter() - start, one/2)
+
+    def testcase25(self):
+        """export of sampled trajectories to columnar files"""
+        import tempfile
+        bodies = []
+        for speed in range(10, 20):
+            football = t.Tr()
+            football.set_vel_trig(speed, 45)
+            football.area = 0.038
+            football.mass = 0.45
+            football.c = 0.25
+            bodies.append(football)
+        batch = t.TrBatch(mass=0.45, area=0.038, c=0.25)
+        batch.set_vel_trig(np.arange(10, 20), 45)
+        sample = bodies[3].sample(bodies[3].landing_point(True)[2], 50, True)
+        self.assertEqual(len(batch), 10)
+        for q, r in zip(batch.sample(bodies[3].landing_point(True)[2], 50, True), sample):
+            self.assertTrue(np.allclose(q[3], r, atol=1e-2))
+
+        with tempfile.TemporaryDirectory() as d:
+            # a directory of .npy files, one sample for every 100 ms until impact
+            offsets = t.export_trajectories(os.path.join(d, "bodies"), bodies, air=True, dt=0.1, chunk_size=3)
+            self.assertEqual(len(offsets), 11)
+            data = t.load_trajectories(os.path.join(d, "bodies"))
+            self.assertIsInstance(data["x"], np.memmap)
+            self.assertTrue(np.array_equal(data["offsets"], offsets))
+            for i, body in enumerate(bodies):
+                q = t.load_trajectories(os.path.join(d, "bodies"), i)
+                r = [np.concatenate(c) for c in zip(*body.iter_states(body.landing_point(True)[2], 0.1, True))]
+                self.assertEqual(offsets[i + 1] - offsets[i], len(r[0]))
+                for a, b in zip(q, r):
+                    self.assertTrue(np.array_equal(a, b))
+            t.export_trajectories(os.path.join(d, "batch"), batch, air=True, dt=0.1, chunk_size=4)
+            for a, b in zip(t.load_trajectories(os.path.join(d, "batch"), 7),
+                            t.load_trajectories(os.path.join(d, "bodies"), 7)):
+                self.assertTrue(np.allclose(a, b, atol=1e-2))
+
+            # a .npz file with 50 samples per body until a given time
+            offsets = t.export_trajectories(os.path.join(d, "bodies.npz"), bodies, 1.0, 50, True)
+            self.assertTrue(np.array_equal(offsets, np.arange(0, 501, 50)))
+            q = t.load_trajectories(os.path.join(d, "bodies.npz"), 3)
+            for a, b in zip(q, bodies[3].sample(1.0, 50, True)):
+                self.assertTrue(np.array_equal(a, b))
+            self.assertRaises(ValueError, t.export_trajectories, os.path.join(d, "x"), bodies, format="csv")
+
+            # a body that lands at once
+            football = t.Tr()
+            football.init_vel = [5, -1]
+            football.area = 0.038
+            football.mass = 0.45
+            football.c = 0.25
+            self.assertTrue(np.array_equal(t.export_trajectories(os.path.join(d, "ground.npz"), football, air=True, n=3),
+                                           [0, 3]))
+            self.assertTrue(np.array_equal(t.load_trajectories(os.path.join(d, "ground.npz"), 0)[3], [5, 5, 5]))
+
+            try:
+                import pyarrow
+            except ImportError:
+                pyarrow = None
+            if pyarrow is not None:
+                t.export_trajectories(os.path.join(d, "bodies.parquet"), bodies, air=True, dt=0.1, chunk_size=3)
+                for a, b in zip(t.load_trajectories(os.path.join(d, "bodies.parquet"), 5),
+                                t.load_trajectories(os.path.join(d, "bodies"), 5)):
+                    self.assertTrue(np.array_equal(a, b))
+                data = t.load_trajectories(os.path.join(d, "bodies.parquet"))
+                self.assertTrue(np.array_equal(data["offsets"], t.load_trajectories(os.path.join(d, "bodies"))["offsets"]))
+
+    def testcase26(self):
+        """three dimensions with crosswind and spin"""
+        from matplotlib.figure import Figure
+        from scipy.integrate import solve_ivp
+        football = t.Tr3D(mass=0.45, area=0.038, c=0.25)
+        football.set_vel_trig([20, 25], 45)
+        batch = t.TrBatch(mass=0.45, area=0.038, c=0.25)
+        batch.set_vel_trig([20, 25], 45)
+        x, y, z, t1 = football.landing_point(True)
+        x2, y2, t2 = batch.landing_point(True)
+        self.assertTrue(np.allclose(x, x2) and np.allclose(t1, t2) and np.all(z == 0))
+        x, y, z, t1 = football.max_alt(True)
+        x2, y2, t2 = batch.max_alt(True)
+        self.assertTrue(np.allclose(x, x2) and np.allclose(y, y2) and np.allclose(t1, t2))
+        x, y, z, t1 = football.landing_point()
+        self.assertTrue(np.allclose(x, batch.landing_point()[0]) and np.all(z == 0))
+        self.assertEqual(len(football), 2)
+
+        # the range does not depend on the azimuth
+        football.set_vel_trig(20, 45, 30)
+        x, y, z, t1 = football.landing_point(True)
+        self.assertAlmostEqual(math.hypot(x[0], z[0]), 29.598, delta=0.001)
+        self.assertAlmostEqual(math.atan2(z[0], x[0])*180/math.pi, 30, delta=1e-6)
+
+        # crosswind towards +z, only with air resistance
+        football.set_vel_trig(20, 45)
+        football.env = t.Environment(wind=(0, 0, 5))
+        self.assertEqual(football.landing_point()[2][0], 0)
+        self.assertGreater(football.landing_point(True)[2][0], 2)
+        self.assertAlmostEqual(football.landing_point(True)[1][0], 0, delta=1e-9)
+
+        # Magnus force, compared with an accurate integration
+        football.env = None
+        football.spin = (0, 0, 30)  # backspin
+        self.assertRaises(RuntimeError, football.landing_point, True)
+        football.radius = 0.11
+        self.assertGreater(football.landing_point(True)[0][0], 31)
+        football.spin = (0, 30, 20)
+        w = np.array(football.spin)
+
+        def f(s, r):
+            u = r[0::2]
+            a = -0.5*1.204*0.25*0.038/0.45*np.linalg.norm(u)*u + 0.5*1.204*0.038*0.11/0.45*np.cross(w, u)
+            return [a[0], r[0], a[1] - 9.8, r[2], a[2], r[4]]
+        hit = lambda s, r: r[3]
+        hit.terminal = True
+        hit.direction = -1
+        sol = solve_ivp(f, [0, 10], [20/2**0.5, 0, 20/2**0.5, 0, 0, 0], events=hit, rtol=1e-10, atol=1e-10)
+        x, y, z, t1 = football.landing_point(True)
+        self.assertAlmostEqual(x[0], sol.y_events[0][0][1], delta=1e-4)
+        self.assertAlmostEqual(z[0], sol.y_events[0][0][5], delta=1e-4)
+        self.assertAlmostEqual(t1[0], sol.t_events[0][0], delta=1e-4)
+        self.assertLess(z[0], -5)  # spin about the y-axis curves towards -z
+        s = football.sample(t1[0], 11, True)
+        self.assertAlmostEqual(s[3][0, -1], z[0], delta=1e-6)
+        self.assertTrue(np.allclose(football.pos(t1[0]/2, True), [q[:, 5] for q in s[1:4]]))
+        self.assertTrue(np.allclose(football.v(t1[0]/2, True), [q[:, 5] for q in s[4:]]))
+
+        ax = Figure().add_subplot(projection="3d")
+        football.add_plot(t1, True, ax=ax)
+        self.assertEqual(len(ax.lines), 1)
+
+    def testcase27(self):
+        """fixed-step population of bodies"""
+        speed = np.linspace(10, 40, 50)
+        a = np.linspace(10, 80, 50)*math.pi/180
+        vel = np.stack([speed*np.cos(a), speed*np.sin(a)], -1)
+        batch = t.TrBatch((0, 0), vel, 0.45, 0.038, 0.25)
+        batch.rtol = 1e-10
+        batch.atol = 1e-10
+        x_ref, y_ref, t_ref = batch.landing_point(True)
+        for method, tol in [("rk4", 1e-6), ("semi-implicit", 0.5)]:
+            population = t.Population(8, method)
+            ids = population.add((0, 0), vel, 0.45, 0.038, 0.25)
+            self.assertTrue(np.array_equal(ids, np.arange(50)))
+            self.assertEqual(len(population), 50)
+            x_err, t_err = population.error(1/60)
+            x = np.full(50, np.nan)
+            t1 = np.full(50, np.nan)
+            frames = 0
+            while len(population):
+                i, xi, ti = population.step(1/60)
+                x[i] = xi
+                t1[i] = ti
+                frames += 1
+            self.assertLess(np.max(np.abs(x - x_ref)), tol)
+            self.assertAlmostEqual(np.max(np.abs(x - x_ref)), x_err, delta=1e-12)
+            self.assertAlmostEqual(np.max(np.abs(t1 - t_ref)), t_err, delta=1e-12)
+            self.assertEqual(frames, math.ceil(max(t1)*60))
+
+        # bodies added during the flight keep their own age, positions match TrBatch
+        population = t.Population()
+        population.add((0, 0), [20, 20], 0.45, 0.038, 0.25)
+        population.step(0.5, 0.01)
+        self.assertEqual(population.substeps, 50)
+        population.add((0, 0), [20, 20], 0.45, 0.038, 0.25)
+        population.step(0.5, 0.01)
+        batch = t.TrBatch((0, 0), [(20, 20), (20, 20)], 0.45, 0.038, 0.25)
+        self.assertTrue(np.allclose(population.age(), [1, 0.5]))
+        self.assertTrue(np.allclose(population.pos(), batch.pos(np.array([1, 0.5]), True), atol=1e-6))
+        self.assertTrue(np.allclose(population.v(), batch.v(np.array([1, 0.5]), True), atol=1e-6))
+        self.assertTrue(np.array_equal(population.ids(), [0, 1]))
+
+        # the budget limits the evaluations of one step
+        nfev = population.nfev
+        population.step(0.5, 0.01, budget=100)
+        self.assertEqual(population.substeps, 12)
+        self.assertLessEqual(population.nfev - nfev, 100)
+
+        # instrument() counts the evaluations of the bodies in flight, not those that landed in an earlier substep
+        population = t.Population()
+        population.add((0, 0), [(5, 5), (20, 20)], 0.45, 0.038, 0.25)
+        with t.instrument() as stats:
+            self.assertEqual(len(population.step(2, 0.01)[0]), 1)
+        self.assertEqual(stats.nfev, population.nfev)
+        self.assertEqual(stats.steps, population.nfev//4)
+        self.assertLess(stats.nfev, 4*2*200)
+        self.assertRaises(ValueError, t.Population, 8, "euler")
+
+    def testcase28(self):
+        """derivatives of the landing point, compared with central differences"""
+        def shot(speed, angle, mass, c, env):
+            football = t.Tr()
+            football.init_pos = [0, 1]
+            football.set_vel_trig(speed, angle)
+            football.area = 0.038
+            football.mass = mass
+            football.c = c
+            football.rtol = 1e-10
+            football.atol = 1e-10
+            football.env = env
+            return football
+
+        for env in [None, t.Environment(wind=(-4, 1)), t.standard_atmosphere()]:
+            for air in [False, True]:
+                p, dx, dt = shot(20, 40, 0.45, 0.25, env).landing_gradient(air)
+                q = shot(20, 40, 0.45, 0.25, env).landing_point(air)
+                self.assertAlmostEqual(p[0], q[0], delta=1e-6)
+                self.assertAlmostEqual(p[2], q[2], delta=1e-6)
+                args = [20, 40, 0.45, 0.25]
+                for i, h in enumerate([1e-4, 1e-4, 1e-6, 1e-6]):
+                    up = list(args)
+                    up[i] += h
+                    down = list(args)
+                    down[i] -= h
+                    a = shot(*up, env).landing_point(air)
+                    b = shot(*down, env).landing_point(air)
+                    self.assertAlmostEqual(dx[i], (a[0] - b[0])/(2*h), delta=1e-6)
+                    self.assertAlmostEqual(dt[i], (a[2] - b[2])/(2*h), delta=1e-6)
+        self.assertEqual(shot(20, 40, 0.45, 0.25, None).landing_gradient()[1][2:], [0, 0])
+
+        # a first order estimate after a small change of the mass
+        football = shot(20, 40, 0.45, 0.25, None)
+        football.rtol = 1e-6
+        football.atol = 1e-6
+        p, dx, dt = football.landing_gradient(True)
+        football.mass = 0.46
+        self.assertAlmostEqual(football.landing_point(True)[0], p[0] + dx[2]*0.01, delta=0.01)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file